@@ -0,0 +1,130 @@
+'''Benchmark for exporting the patches of a repository with createpatches.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_createpatches
+
+Creates a synthetic repository with 10k commits and a baseline every 1000
+commits, then exports the patches between all baselines. "before" finds
+the range endpoints with a pydriller traversal, exports the whole range
+with format-patch and deletes the baseline patches afterwards. It is only
+run if pydriller is installed. "after" uses extract_patches_for_repo.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import glob
+import os
+import subprocess
+import tempfile
+import time
+
+from git import Repo
+
+from commands.baseline import (create_baseline_string, extract_patches_for_repo,
+                               get_baseline_prefix, get_baselines_from_path)
+from configuration.data import BaselineSet
+
+try:
+    import pydriller
+except ImportError:
+    pydriller = None
+
+COMMIT_COUNT = 10000
+BASELINE_EVERY = 1000
+FILE_COUNT = 100
+
+
+def create_repository(path):
+    '''Creates the synthetic repository at path using git fast-import'''
+    subprocess.run(["git", "init", "-q", path], check=True)
+    stream = []
+    for index in range(COMMIT_COUNT + 1):
+        if index % BASELINE_EVERY == 0:
+            message = create_baseline_string("bench_" + str(index // BASELINE_EVERY))
+            change = ""
+        else:
+            message = "change " + str(index)
+            content = "line " + str(index) + "\n"
+            change = (f"M 644 inline file_{index % FILE_COUNT}.txt\n"
+                      f"data {len(content)}\n{content}")
+        parent = f"from :{index}\n" if index else ""
+        stream.append(
+            f"commit refs/heads/main\nmark :{index + 1}\n"
+            f"committer Bench <bench@example.com> {1600000000 + index} +0000\n"
+            f"data {len(message)}\n{message}\n{parent}{change}")
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, check=True,
+                   input="".join(stream).encode("utf-8"))
+    subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=path, check=True)
+    subprocess.run(["git", "reset", "-q", "--hard"], cwd=path, check=True)
+
+
+def get_baseline_pairs(path):
+    '''Returns the baseline pairs like createpatches, leaving out the
+    newest baseline as the repository ends with it'''
+    baselines = get_baselines_from_path(path, 0, True)
+    order = baselines.order
+    return [{"from": baselines.repositories(order[i]),
+             "to": baselines.repositories(order[i - 1]),
+             "name": order[i],
+             "parent": order[i + 1] if i + 1 < len(order) else ""}
+            for i in reversed(range(1, len(order)))]
+
+
+def export_before(path, patchdir, pairs):
+    '''Previous implementation of the export of a single repository'''
+    for pair in pairs:
+        first_hash = None
+        last_hash = None
+        pydriller_repo = pydriller.Repository(
+            path,
+            from_commit=pair["from"][BaselineSet.normalize_path(path)],
+            to_commit=pair["to"][BaselineSet.normalize_path(path)])
+        for commit in pydriller_repo.traverse_commits():
+            if first_hash is None:
+                first_hash = commit.hash
+            last_hash = commit.hash
+        patch_dir = os.path.join(patchdir, pair["name"])
+        Repo(path).git.format_patch('-o', patch_dir, first_hash + ".." + last_hash)
+        for file in glob.glob(os.path.join(patch_dir, "*.patch")):
+            name = os.path.basename(file)
+            if not name.startswith(get_baseline_prefix()) and get_baseline_prefix() in name:
+                os.remove(file)
+
+
+def export_after(path, patchdir, pairs):
+    '''Current implementation of the export of a single repository'''
+    for pair in pairs:
+        extract_patches_for_repo(path, path, patchdir, pair, False)
+
+
+def measure(function, path, patchdir, pairs):
+    '''Returns the runtime of function and the number of created patches'''
+    start = time.perf_counter()
+    function(path, patchdir, pairs)
+    duration = time.perf_counter() - start
+    return duration, len(glob.glob(os.path.join(patchdir, "*", "*.patch")))
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "repo")
+        create_repository(path)
+        pairs = get_baseline_pairs(path)
+        print(f"{COMMIT_COUNT} commits, {len(pairs)} baseline ranges:")
+        if pydriller is None:
+            print("  before: skipped, pydriller is not installed")
+        else:
+            duration, patches = measure(
+                export_before, path, os.path.join(temp_dir, "before"), pairs)
+            print(f"  before: {duration:7.2f} s, {patches} patches")
+        duration, patches = measure(
+            export_after, path, os.path.join(temp_dir, "after"), pairs)
+        print(f"  after:  {duration:7.2f} s, {patches} patches")
+
+
+if __name__ == '__main__':
+    main()
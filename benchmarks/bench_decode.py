@@ -0,0 +1,71 @@
+'''Benchmark comparing dataclasses_json with the fast decoding path.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decode
+
+Decodes a few thousand synthetic layer files as well as a single large
+patches.json with both decoders.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import timeit
+
+from configuration import decode
+from configuration.data import PatchConfig, PatchLayer, PatchSet
+
+LAYER_COUNT = 3000
+PATCHES_PER_LAYER = 10
+
+
+def create_layer_files(count, patches_per_layer):
+    '''Returns the json content of count layers with the given number of patches each'''
+    contents = []
+    for index in range(count):
+        layer = PatchLayer(
+            id="layer_" + str(index),
+            parent="layer_" + str(index - 1) if index else "",
+            title="Layer " + str(index),
+            description="Synthetic layer used for benchmarking",
+            patches=[
+                PatchConfig(
+                    basePath="sub_" + str(patch % 4),
+                    patch="layer_" + str(index) + "/" + str(patch).zfill(4) + "-change.patch",
+                    tags="bsp, test")
+                for patch in range(patches_per_layer)])
+        contents.append(layer.to_json(indent=4))  # pylint: disable=no-member
+    return contents
+
+
+def measure(function, contents):
+    '''Returns the best time of a few runs decoding all contents'''
+    return min(timeit.repeat(
+        lambda: [function(content) for content in contents], number=1, repeat=3))
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    print("json backend:", decode.loads.__module__)
+    contents = create_layer_files(LAYER_COUNT, PATCHES_PER_LAYER)
+    # pylint: disable=no-member
+    reference = measure(PatchLayer.from_json, contents)
+    fast = measure(decode.patch_layer_from_json, contents)
+    print(f"{LAYER_COUNT} layer files, {PATCHES_PER_LAYER} patches each:")
+    print(f"  dataclasses_json: {reference * 1000:10.1f} ms")
+    print(f"  fast path:        {fast * 1000:10.1f} ms ({reference / fast:.1f}x)")
+
+    patch_set = PatchSet(patches=[
+        patch for content in contents for patch in decode.patch_layer_from_json(content).patches])
+    patch_set_content = [patch_set.to_json(indent=2)]
+    reference = measure(PatchSet.from_json, patch_set_content)
+    fast = measure(decode.patch_set_from_json, patch_set_content)
+    print(f"patches.json with {len(patch_set.patches)} patches:")
+    print(f"  dataclasses_json: {reference * 1000:10.1f} ms")
+    print(f"  fast path:        {fast * 1000:10.1f} ms ({reference / fast:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''Benchmark for the layer tree construction.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_layer_tree
+
+Builds synthetic layer sets of growing size and reports the time needed
+to create the layer tree. The time per layer should stay roughly
+constant, e.g. construction scales linearly with the number of layers.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import random
+import timeit
+
+from configuration.data import PatchLayer
+from configuration.tree import build_layer_tree
+
+SIZES = [250, 500, 1000, 2000, 4000, 8000]
+MIXIN_RATIO = 0.05
+
+
+def create_layers(count, seed=42):
+    '''Creates a random layer hierarchy with count layers below a root layer.
+    A small share of the layers uses multiple parents.'''
+    rng = random.Random(seed)
+    base_layer = PatchLayer(id="root", title="root")
+    ids = ["root"]
+    layers = []
+    for index in range(count):
+        layer_id = "layer_" + str(index)
+        if len(ids) > 2 and rng.random() < MIXIN_RATIO:
+            parents = rng.sample(ids, 2)
+            layers.append(PatchLayer(id=layer_id, parents=parents))
+            ids.extend(layer_id + "_" + str(pos + 1) for pos in range(len(parents)))
+        else:
+            layers.append(PatchLayer(id=layer_id, parent=rng.choice(ids)))
+            ids.append(layer_id)
+    # the order of the layer files is arbitrary...
+    rng.shuffle(layers)
+    return base_layer, layers
+
+
+def main():
+    '''Runs the benchmark and prints a small table'''
+    print(f"{'layers':>8} {'nodes':>8} {'total [ms]':>12} {'per layer [us]':>15}")
+    for size in SIZES:
+        base_layer, layers = create_layers(size)
+        nodes = len(build_layer_tree(base_layer, layers))
+        runs = 5
+        total = min(timeit.repeat(
+            lambda: build_layer_tree(base_layer, layers),  # pylint: disable=cell-var-from-loop
+            number=1, repeat=runs))
+        print(f"{size:>8} {nodes:>8} {total * 1000:>12.2f} {total / size * 1e6:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
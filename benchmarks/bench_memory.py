@@ -0,0 +1,114 @@
+'''Memory benchmark for the layer data classes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory
+
+Loads a synthetic configuration with 50k patches, part of them in layers
+with multiple parents, and reports the memory used per patch. "before"
+uses data classes without __slots__, keeps every string separately and
+deep-copies multi-parent layers. "after" uses the classes and decoder
+of this repository.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import copy
+import dataclasses
+import gc
+import json
+import tracemalloc
+
+from configuration.data import PatchConfig, PatchLayer
+from configuration.decode import patch_config_from_dict
+from configuration.tree import build_layer_tree
+
+LAYER_COUNT = 500
+PATCHES_PER_LAYER = 100
+MIXIN_EVERY = 10
+MIXIN_PARENTS = 3
+
+
+def without_slots(cls):
+    '''Returns a copy of a data class without __slots__'''
+    return dataclasses.make_dataclass(
+        cls.__name__ + "WithoutSlots",
+        [(field.name, field.type, dataclasses.field(
+            default=field.default, default_factory=field.default_factory))
+         for field in dataclasses.fields(cls)])
+
+
+def create_layer_dicts():
+    '''Returns the decoded json of the synthetic layers'''
+    layers = []
+    for index in range(LAYER_COUNT):
+        layer = {"id": "layer_" + str(index), "title": "Layer " + str(index), "patches": []}
+        if index and index % MIXIN_EVERY == 0:
+            layer["parents"] = ["layer_" + str(index - parent - 1) for parent in range(MIXIN_PARENTS)]
+        elif index:
+            layer["parent"] = "layer_" + str(index - 1)
+        for patch in range(PATCHES_PER_LAYER):
+            layer["patches"].append({
+                "basePath": "sub_" + str(patch % 4),
+                "patch": "layer_" + str(index) + "/" + str(patch).zfill(4) + "-change.patch",
+                "tags": "bsp, test"})
+        layers.append(layer)
+    # json round trip, so each value is a separate object like after reading files
+    return json.loads(json.dumps(layers))
+
+
+def load_before(layer_dicts):
+    '''Previous representation: no slots, no interning, deep copies per parent'''
+    config_cls = without_slots(PatchConfig)
+    layer_cls = without_slots(PatchLayer)
+    layers = []
+    for layer_dict in json.loads(json.dumps(layer_dicts)):
+        patches = [config_cls(**patch) for patch in layer_dict.pop("patches")]
+        layers.append(layer_cls(patches=patches, **layer_dict))
+    expanded = []
+    for layer in layers:
+        for pos in range(len(layer.parents)):
+            new_layer = copy.deepcopy(layer)
+            new_layer.id = layer.id + "_" + str(pos + 1)
+            expanded.append(new_layer)
+    return layers, expanded
+
+
+def load_after(layer_dicts):
+    '''Current representation'''
+    layers = []
+    for layer_dict in json.loads(json.dumps(layer_dicts)):
+        patches = [patch_config_from_dict(patch) for patch in layer_dict.pop("patches")]
+        layers.append(PatchLayer(patches=patches, **layer_dict))
+    return layers, build_layer_tree(layers[0], layers[1:])
+
+
+def measure(function, layer_dicts):
+    '''Returns the memory still allocated after running function'''
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = function(layer_dicts)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del result
+    return used
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    layer_dicts = create_layer_dicts()
+    patches = LAYER_COUNT * PATCHES_PER_LAYER
+    before = measure(load_before, layer_dicts)
+    after = measure(load_after, layer_dicts)
+    print(f"{patches} patches in {LAYER_COUNT} layers, every {MIXIN_EVERY}th layer "
+          f"has {MIXIN_PARENTS} parents:")
+    print(f"  before: {before / 2**20:8.1f} MiB, {before / patches:6.0f} bytes per patch")
+    print(f"  after:  {after / 2**20:8.1f} MiB, {after / patches:6.0f} bytes per patch")
+
+
+if __name__ == '__main__':
+    main()
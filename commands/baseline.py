@@ -5,33 +5,39 @@ __license__ = "MIT"
 __version__ = "0.1.0"
 __status__ = "Development"
 
-import glob
+import concurrent.futures
 import hashlib
+import json
 import logging
 import os
 import pprint
 
 import click
-import pydriller
-from git import Repo
+from git import GitCommandError
 
 from configuration import data
-from shared.helpers import exit_with_error, remove_empty_folders, exit_application
+from shared.helpers import exit_with_error, get_jobs, remove_empty_folders, exit_application
+from shared.repos import get_repo
+from shared.submodules import get_post_order, get_repository_tree, walk_repositories
 
 # Logging setup...
 logger = logging.getLogger(__name__)
 
+# Increase this whenever the format of the baseline cache changes
+BASELINE_CACHE_VERSION = 1
+
 @click.command()
 @click.option(
     '--workdir', '-w', required=True,
     type=click.Path(exists=True),
     default=".",
     help='Workdir that holds the repo(s) to analyze.')
-def listsubmodules(workdir):
+@click.pass_context
+def listsubmodules(ctx, workdir):
     '''Lists all submodules and their respective baselines.
      Meant for debugging and/or repo analysis.'''
     workdir = normalize_workdir_path(workdir)
-    baselines = get_baselines_from_path(workdir, 0, False)[0]
+    baselines = get_baselines_from_path(workdir, 0, False, get_jobs(ctx))
     if not baselines_are_valid(baselines):
         logger.error("Invalid baseline set!")
 
@@ -42,11 +48,12 @@ def listsubmodules(workdir):
     type=click.Path(exists=True),
     default=".",
     help='Workdir that holds the repo(s) to analyze.')
-def showbaselines(workdir):
+@click.pass_context
+def showbaselines(ctx, workdir):
     '''Lists all available baselines and checks the repo vor validity
      (e.g. all submodules contain the same ordered set of baselines).'''
     workdir = normalize_workdir_path(workdir)
-    baselines, order = get_baselines_from_path(workdir, 0, True)
+    baselines = get_baselines_from_path(workdir, 0, True, get_jobs(ctx))
     if not baselines_are_valid(baselines):
         logger.error("Invalid baseline set!")
     else:
@@ -54,7 +61,7 @@ def showbaselines(workdir):
             logger.info("No baselines found!")
         else:
             logger.info("Baselines are valid. Avaliable baselines are:")
-            for baseline in order:
+            for baseline in baselines.order:
                 logger.info("- %s", baseline)
 
 
@@ -65,9 +72,10 @@ def showbaselines(workdir):
     default=".",
     help='Workdir that holds the repo(s) to analyze.')
 @click.argument('baseline', type=click.STRING)
-def addbaseline(workdir, baseline):
+@click.pass_context
+def addbaseline(ctx, workdir, baseline):
     '''Adds a baseline with the given name to the repository structure.'''
-    add_baseline_internal(workdir, baseline)
+    add_baseline_internal(workdir, baseline, get_jobs(ctx))
 
 @click.command()
 @click.option(
@@ -82,47 +90,25 @@ def addbaseline(workdir, baseline):
     '--clean', '-c', is_flag=True, required=False,
     type=click.BOOL, default=False, help='If set, also performs git clean -xfd on all repos after reset, removing non-tracked files.')
 @click.argument('baseline', type=click.STRING, default="")
-def reverttobaseline(workdir, baseline, all, clean):
+@click.pass_context
+def reverttobaseline(ctx, workdir, baseline, all, clean):
     '''Sets the repository structure to the commit before the one marked
      by the baseline (removing all later commits and the baseline commit).'''
+    jobs = get_jobs(ctx)
     workdir = normalize_workdir_path(workdir)
-    baselines = get_baselines_from_path(workdir, 0, True)[0]
+    baselines = get_baselines_from_path(workdir, 0, True, jobs)
     if all:
         logger.info("Resetting all repos to before the first baseline entry.")
         if len(baselines) == 0:
             if clean:
                 clean_workdir(workdir)
             exit_application("Repository contains no baselines, nothing to remove!")
-        main_repo = Repo(workdir)
-        distance = -1
-        oldest_baseline = None
-        # logger.info(baselines.keys())
-        for baseline_to_check in baselines:
-            repo_commit = None
-            for path in baselines[baseline_to_check]:
-                logger.info(path)
-                if workdir in path:
-                    repo_commit = path[workdir]
-            if repo_commit is None:
-                # first try and do a full path lookup...
-                for path in baselines[baseline_to_check]:
-                    logger.info(path)
-                    abspath = os.path.abspath(workdir)
-                    if abspath in path:
-                        repo_commit = path[abspath]
-                    if repo_commit is None:
-                        exit_with_error("Error during lookup!")
-            result = int(
-                main_repo.git.rev_list(
-                    "--count",
-                    str(repo_commit) + ".." + str(main_repo.head.commit)))
-            if result > distance:
-                distance = result
-                oldest_baseline = baseline_to_check
-        if oldest_baseline is None:
+        # order lists the baselines of the main repo from newest to oldest
+        if not baselines.order:
             exit_with_error("Repo in " + workdir + " contains no marked baselines!")
+        oldest_baseline = baselines.order[-1]
         logger.info("Oldest baseline in set: %s", oldest_baseline)
-        reset_hard_to_baseline(workdir, baselines[oldest_baseline])
+        reset_hard_to_baseline(workdir, baselines, oldest_baseline, jobs)
     else:
         if not baseline:
             exit_with_error("Either specify all or provide a baseline name")
@@ -130,7 +116,7 @@ def reverttobaseline(workdir, baseline, all, clean):
             exit_with_error("Invalid baseline: " + baseline)
         logger.info(
             "Resetting all repos to the commit before baseline %s", baseline)
-        reset_hard_to_baseline(workdir, baselines[baseline])
+        reset_hard_to_baseline(workdir, baselines, baseline, jobs)
 
     if clean:
         clean_workdir(workdir)
@@ -138,7 +124,7 @@ def reverttobaseline(workdir, baseline, all, clean):
 def clean_workdir(workdir):
     logger.info("Cleaning workdir: %s", workdir)
     try:
-        repo = Repo(workdir)
+        repo = get_repo(workdir)
         repo.git.clean(['-xfd'])
         repo.git.submodule(['foreach', '--recursive', 'git', 'clean', '-xfd'])
     except git.exc.GitError as error:
@@ -156,7 +142,8 @@ def clean_workdir(workdir):
     help='''If set, all (starting) empty baseline
         commits are included in the patch set.''')
 @click.argument('outpath', type=click.Path(exists=False))
-def createpatches(workdir, outpath, includebaseline):
+@click.pass_context
+def createpatches(ctx, workdir, outpath, includebaseline):
     '''Walks through repo and creates patches and patchset configurations
        For each found baseline. Each patchset starts at the baseline
        - taking its name - and contains all commits as single patches
@@ -168,30 +155,27 @@ def createpatches(workdir, outpath, includebaseline):
     patchdir = os.path.join(outpath, "patches")
     os.mkdir(patchdir)
 
+    jobs = get_jobs(ctx)
     workdir = normalize_workdir_path(workdir)
-    baselines, baseline_order = get_baselines_from_path(workdir, 0, True)
+    baselines = get_baselines_from_path(workdir, 0, True, jobs)
     if not baselines_are_valid(baselines):
         exit_with_error("Invalid baseline configuration!")
 
     logger.info("Storing patches in %s", patchdir)
+    baseline_order = baselines.order
     baseline_pairs = []
     logger.info(baseline_order)
     logger.info(baselines)
     for i in reversed(range(len(baseline_order))):
-        pair = {"from": baselines[baseline_order[i]]}
+        # from/to hold the baseline commits keyed by repository path
+        pair = {"from": baselines.repositories(baseline_order[i])}
         if i > 0:
             # last item only holds one...
-            pair["to"] = baselines[baseline_order[i-1]]
-        for entry in baselines[baseline_order[i]]:
-            pair["name"] = get_message_parts(
-                    entry[list(entry.keys())[0]].message
-                )[2].strip()
-        if i+1 is not len(baselines):
-            # fetch the previous one
-            for entry in baselines[baseline_order[i+1]]:
-                pair["parent"] = get_message_parts(
-                        entry[list(entry.keys())[0]].message
-                    )[2].strip()
+            pair["to"] = baselines.repositories(baseline_order[i-1])
+        pair["name"] = baseline_order[i]
+        if i + 1 < len(baseline_order):
+            # the previous one is the parent
+            pair["parent"] = baseline_order[i+1]
         else:
             pair["parent"] = ""
         baseline_pairs.append(pair)
@@ -201,50 +185,62 @@ def createpatches(workdir, outpath, includebaseline):
     for pair in baseline_pairs:
         if len(pair) > 4 or len(pair) < 3:
             exit_with_error("Invalid baseline pair configuration!")
-        result = extract_patches(
-            workdir,
-            workdir,
-            patchdir,
-            pair,
-            includebaseline)
+    results = extract_patches(
+        workdir,
+        workdir,
+        patchdir,
+        baseline_pairs,
+        includebaseline,
+        jobs)
+    for pair, result in zip(baseline_pairs, results):
         patch_layer_content = result.to_json(indent=4)
         logger.info(patch_layer_content)
         layer_filename = os.path.join(outpath, pair["name"] + ".json")
         with open(layer_filename, "w", encoding="utf-8") as layer_file:
             layer_file.write(patch_layer_content)
 
-def add_baseline_internal(workdir, baseline):
+def add_baseline_internal(workdir, baseline, jobs=1):
     '''Internal implementation of adding a baseline to a given git repository'''
     workdir = normalize_workdir_path(workdir)
     logger.info("Adding baseline commit %s to each repo under %s",
                 baseline, workdir)
-    add_recursive_commit(workdir,  create_baseline_string(baseline))
+    add_recursive_commit(workdir,  create_baseline_string(baseline), jobs=jobs)
 
-def extract_patches(path, base_dir, patchdir, baseline_pair, include_baseline):
-    '''Extracts patches from a repository and puts then in a given folder'''
-    repo = Repo(path)
-    result = data.PatchLayer(
-        id=baseline_pair["name"],
-        parent=baseline_pair["parent"],
-        title="Auto-generated layer for baseline: "
-        + baseline_pair["name"],
-        description="")
-    for module in repo.submodules:
-        sub_repo = extract_patches(
-            module.module().working_tree_dir,
-            base_dir,
-            patchdir,
-            baseline_pair,
-            include_baseline)
-        result.patches.extend(sub_repo.patches)
-    sub_repo = extract_patches_for_repo(
-        path,
-        base_dir,
-        patchdir,
-        baseline_pair,
-        include_baseline)
-    result.patches.extend(sub_repo.patches)
-    return result
+def extract_patches(path, base_dir, patchdir, baseline_pairs, include_baseline, jobs=1):
+    '''Extracts the patches of each baseline pair from a repository and its
+    submodules and puts them in a given folder. Returns a PatchLayer per pair.
+
+    All pairs and repositories are exported independently, using up to jobs
+    threads. The patches of submodules come before the ones of the repo
+    itself, like in a serial export.'''
+    repositories = [repo_path for repo_path, _ in get_post_order(get_repository_tree(path))]
+    exports = [(pair, repo_path) for pair in baseline_pairs for repo_path in repositories]
+
+    def export(pair_and_repo):
+        pair, repo_path = pair_and_repo
+        return extract_patches_for_repo(repo_path, base_dir, patchdir, pair, include_baseline)
+
+    if jobs <= 1 or len(exports) < 2:
+        exported = [export(pair_and_repo) for pair_and_repo in exports]
+    else:
+        # map keeps the order and raises the error of the first failed export
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            exported = list(executor.map(export, exports))
+
+    results = []
+    for index, pair in enumerate(baseline_pairs):
+        result = data.PatchLayer(
+            id=pair["name"],
+            parent=pair["parent"],
+            title="Auto-generated layer for baseline: "
+            + pair["name"],
+            description="")
+        for repo_result in exported[index * len(repositories):(index + 1) * len(repositories)]:
+            result.patches.extend(repo_result.patches)
+        results.append(result)
+    # clean up the created empty patch folders
+    remove_empty_folders(patchdir, False)
+    return results
 
 
 def extract_patches_for_repo(
@@ -263,114 +259,194 @@ def extract_patches_for_repo(
     # we assume a valid configuration, as in:
     # all repos in "from" have an entry in "to"
 
-    result = None
-    for entry in baseline_pair["from"]:
-        if path in entry.keys():
-            from_commit = entry[path]
-            to_commit = None
-
-            if "to" in baseline_pair:
-                for to_entry in baseline_pair["to"]:
-                    if path in to_entry.keys():
-                        logger.info(path)
-                        to_commit = to_entry[path]
-                if to_commit is None:
-                    exit_with_error("Invalid baseline pair configuration!")
-
-            relative_path = os.path.relpath(path, base_dir)
-            first_hash = None
-            last_hash = None
-            pydriller_repo = None
-            if (
-                "to" in baseline_pair
-                and from_commit.hexsha is not to_commit.hexsha
-            ):
-                pydriller_repo = pydriller.Repository(
-                    path,
-                    from_commit=from_commit.hexsha,
-                    to_commit=to_commit.hexsha)
-            else:
-                pydriller_repo = pydriller.Repository(path, single=from_commit.hexsha)
-            commit = None
-            for commit in pydriller_repo.traverse_commits():
-                if first_hash is None:
-                    first_hash = commit.hash
-                last_hash = commit.hash
-            logger.info(first_hash)
-            logger.info(last_hash)
-            logger.info(pydriller_repo)
-
-            patch_dir = os.path.join(
-                patchdir,
-                baseline_pair["name"],
-                relative_path)
-            result = data.PatchLayer(
-                id=baseline_pair["name"],
-                parent=baseline_pair["parent"],
-                title="Auto-generated layer for baseline: "+ baseline_pair["name"],
-                description="Auto-generated layer for baseline: "
-                + baseline_pair["name"])
-            if first_hash and last_hash:
-                repo = Repo(path)
-                if first_hash is last_hash:
-                    if commit is not None:
-                        repo.git.format_patch('-o', patch_dir, commit.hash)
-                    else:
-                        exit_with_error("Invalid commit during lookup!")
-                else:
-                    repo.git.format_patch(
-                        '-o',
-                        patch_dir,
-                        str(first_hash) + ".." + str(last_hash))
-
-                if not include_baseline:
-                # this is a bit hacky but: lets remove the baseline patches
-                # if based on created filename...
-                ## TODO: Do this right, e.g.: don't create the patches in the first place...
-                    patch_files = glob.glob(os.path.join(patch_dir, "*.patch"))
-                    for file in patch_files:
-                        logger.info("----------------------------------- File: %s", file)
-                        if is_baseline_patch(os.path.basename(file)):
-                            logger.info("----------------------------------- Deleting %s", file)
-                            os.remove(file)
-
-                # browse the created patches and add them to the patches list
-                patch_files = glob.glob(os.path.join(patch_dir, "*.patch"))
-                for file in sorted(patch_files):
-                    logger.info(file)
-                    result.patches.append(
-                        data.PatchConfig(
-                            basePath=relative_path,
-                            patch=os.path.relpath(file, patchdir),
-                            updateModulesAfterPatch=False)
-                        )
-            else:
-                logger.warning("Missing at least one hash to export")
-                logger.warning(first_hash)
-                logger.warning(last_hash)
-
-    # clean up the created empty patch folders
-    remove_empty_folders(patchdir, False)
-    if not result:
+    from_commit = baseline_pair["from"].get(data.BaselineSet.normalize_path(path))
+    if from_commit is None:
         exit_with_error("Error extracting patches...")
+    if "to" in baseline_pair:
+        to_commit = baseline_pair["to"].get(data.BaselineSet.normalize_path(path))
+        if to_commit is None:
+            exit_with_error("Invalid baseline pair configuration!")
+    else:
+        # the newest baseline reaches up to the current state
+        to_commit = "HEAD"
+    logger.info("Exporting %s..%s", from_commit, to_commit)
+
+    relative_path = os.path.relpath(path, base_dir)
+    patch_dir = os.path.join(
+        patchdir,
+        baseline_pair["name"],
+        relative_path)
+    result = data.PatchLayer(
+        id=baseline_pair["name"],
+        parent=baseline_pair["parent"],
+        title="Auto-generated layer for baseline: "+ baseline_pair["name"],
+        description="Auto-generated layer for baseline: "
+        + baseline_pair["name"])
+    patch_files = export_patches(
+        get_repo(path), patch_dir, from_commit, to_commit, include_baseline)
+
+    # add the created patches to the patches list
+    for file in patch_files:
+        logger.info(file)
+        result.patches.append(
+            data.PatchConfig(
+                basePath=relative_path,
+                patch=os.path.relpath(file, patchdir),
+                updateModulesAfterPatch=False)
+            )
+
     return result
 
 
+def export_patches(repo, patch_dir, from_commit, to_commit, include_baseline):
+    '''Writes one patch per non-merge commit in from_commit..to_commit to
+    patch_dir and returns the created files in commit order.
+
+    Unless include_baseline is set, baseline commits are left out of the
+    export. The remaining commits are exported in runs between the baselines,
+    numbered as if the whole range had been exported at once. As the
+    numbering has gaps then, the subjects are not numbered.'''
+    log = repo.git.log(
+        '-z', '--reverse', '--no-merges', '--format=%H%n%B',
+        from_commit + ".." + to_commit)
+    commits = [entry.split("\n", 1) for entry in log.split("\0") if entry]
+    runs = []
+    previous = from_commit
+    for number, (sha, message) in enumerate(commits, 1):
+        if not include_baseline and is_baseline(message):
+            logger.info("Skipping baseline commit %s", sha)
+        elif runs and runs[-1][2] == previous:
+            runs[-1][2] = sha
+        else:
+            runs.append([number, previous, sha])
+        previous = sha
+
+    # git runs in the repository, so relative paths would end up there
+    options = ['-o', os.path.abspath(patch_dir)]
+    if not include_baseline:
+        options.append('--no-numbered')
+    patch_files = []
+    for start_number, run_from, run_to in runs:
+        output = repo.git.format_patch(
+            *options,
+            '--start-number', str(start_number),
+            run_from + ".." + run_to)
+        patch_files.extend(output.splitlines())
+    return patch_files
+
+
 def get_baselines(repo):
-    '''Returns an directory with the baselines as well as an
-    ordered list (newest ... oldest) of the found baselines
-    in the given repo as a tupel'''
-    baselines = {}
-    order = []
-    for commit in repo.iter_commits():
-        if is_baseline(commit.message):
-            key = get_message_parts(commit.message)[2].strip()
-            if key not in baselines:
-                baselines[key] = []
-            if key not in order:
-                order.append(key)
-            baselines[key].append({repo.working_tree_dir: commit})
-    return baselines, order
+    '''Returns a BaselineSet with the baselines found in the given repo.
+    Its order lists them from newest to oldest.'''
+    baselines = data.BaselineSet()
+    for hexsha, message in get_baseline_commits(repo):
+        key = get_message_parts(message)[2].strip()
+        if key not in baselines:
+            baselines.order.append(key)
+        baselines.add(key, repo.working_tree_dir, hexsha)
+    return baselines
+
+
+def get_baseline_commits(repo):
+    '''Returns (hexsha, message) tuples of all baseline commits reachable
+    from HEAD, newest first. Uses the baseline cache of the repo and only
+    scans the commits added since it was written.'''
+    if not repo.head.is_valid():
+        return []
+    head = repo.head.commit.hexsha
+    cache = read_baseline_cache(repo)
+    if cache is not None and cache["head"] == head:
+        return cache["baselines"]
+    if cache is not None and is_ancestor(repo, cache["head"], head):
+        logger.debug("Updating baseline cache of %s from %s", repo.working_tree_dir, cache["head"])
+        entries = get_baseline_candidates(repo, cache["head"] + "..HEAD") + cache["baselines"]
+    else:
+        entries = get_baseline_candidates(repo)
+    entries = [(hexsha, message) for hexsha, message in entries if is_baseline(message)]
+    write_baseline_cache(repo, head, entries)
+    return entries
+
+
+def get_baseline_candidates(repo, revision_range="HEAD"):
+    '''Returns (hexsha, message) tuples of the commits in revision_range (newest
+    first) whose message starts with the baseline prefix. Git does the filtering,
+    so only these commits need to be checked with is_baseline.'''
+    log = repo.git.log(
+        '-z',
+        '--format=%H%n%B',
+        '--grep=^' + get_baseline_prefix(),
+        revision_range)
+    candidates = []
+    for entry in log.split('\0'):
+        if not entry:
+            continue
+        hexsha, message = entry.split('\n', 1)
+        candidates.append((hexsha, message))
+    return candidates
+
+
+def is_ancestor(repo, ancestor, commit):
+    '''True if ancestor is an ancestor of (or the same as) commit'''
+    try:
+        return repo.is_ancestor(ancestor, commit)
+    except GitCommandError:
+        # e.g. the ancestor commit does not exist anymore
+        return False
+
+
+def get_baseline_cache_file(repo):
+    '''Returns the file caching the baselines of a repo. It is kept in the git dir.'''
+    return os.path.join(repo.git_dir, "tuxlayers", "baselines.json")
+
+
+def read_baseline_cache(repo):
+    '''Returns the cached baselines of a repo as a dict with head and
+    baselines entries or None if there is no usable cache'''
+    cache_file = get_baseline_cache_file(repo)
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file, encoding="utf-8") as cache_content:
+            cache = json.load(cache_content)
+        if cache.get("version") != BASELINE_CACHE_VERSION:
+            return None
+        return {
+            "head": cache["head"],
+            "baselines": [(hexsha, message) for hexsha, message in cache["baselines"]]}
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logger.warning("Ignoring invalid baseline cache %s: %s", cache_file, error)
+        return None
+
+
+def write_baseline_cache(repo, head, baselines):
+    '''Stores the baselines reachable from head, newest first'''
+    cache_file = get_baseline_cache_file(repo)
+    temp_file = cache_file + "." + str(os.getpid()) + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(temp_file, "w", encoding="utf-8") as cache_content:
+            json.dump({
+                "version": BASELINE_CACHE_VERSION,
+                "head": head,
+                "baselines": [list(entry) for entry in baselines]}, cache_content)
+        os.replace(temp_file, cache_file)
+    except OSError as error:
+        logger.warning("Could not write baseline cache %s: %s", cache_file, error)
+
+
+def update_baseline_cache(repo, previous_head):
+    '''Moves the baseline cache of a repo from previous_head to the current HEAD
+    after adding a single commit, e.g. without scanning the history'''
+    cache = read_baseline_cache(repo)
+    if cache is None or cache["head"] != previous_head:
+        return
+    commit = repo.head.commit
+    if [parent.hexsha for parent in commit.parents] != [previous_head]:
+        return
+    baselines = cache["baselines"]
+    if is_baseline(commit.message):
+        baselines = [(commit.hexsha, commit.message)] + baselines
+    write_baseline_cache(repo, commit.hexsha, baselines)
 
 
 def get_baseline_prefix():
@@ -398,15 +474,6 @@ def is_baseline(message):
     parts[2] = parts[2].strip()  # need to remove the trailing \n that gets added...
     return parts[0] == get_baseline_prefix() and parts[1] == get_hash(parts[2])
 
-def is_baseline_patch(filename):
-    '''A simple way of checking if a patchfile is created from a baseline commit'''
-    # this _is_ hacky and it _might_ fail if we do weird stuff /w commit naming...
-    if not filename.endswith(".patch"):
-        return False
-    return not filename.startswith(get_baseline_prefix()) and get_baseline_prefix() in filename
-    # we might check for the hash but this _should_ be clean enough for now.
-    ## TODO: Do this right.
-
 
 def baselines_are_valid(baselines):
     '''Checks the baseline definition for validity (correct order, non-empty, ...)'''
@@ -417,21 +484,21 @@ def baselines_are_valid(baselines):
         # by definition: no baselines is valid
         return True
     logger.info("checking baselines")
-    if not baselines.keys():
+    if not baselines.commits:
         return True
     logger.info(baselines)
-    first_repo = list(baselines.keys())[0]
-    first_baselines = baselines[first_repo]
-    first_length = len(first_baselines)
-    for repo, baseline in baselines.items():
-        if repo is first_repo:
+    first_baseline = baselines.order[0] if baselines.order else list(baselines)[0]
+    first_repositories = baselines.repositories(first_baseline)
+    for baseline in baselines:
+        if baseline == first_baseline:
             continue
 
-        if len(baseline) != first_length:
+        repositories = baselines.repositories(baseline)
+        if len(repositories) != len(first_repositories):
             logger.warning("Baseline mismatch found!")
-            logger.warning(pprint.pformat(baseline, indent=2))
+            logger.warning(pprint.pformat(repositories, indent=2))
             logger.warning("Compared to:")
-            logger.warning(pprint.pformat(first_baselines, indent=2))
+            logger.warning(pprint.pformat(first_repositories, indent=2))
             return False
     return True
 
@@ -456,70 +523,72 @@ def create_baseline_string(message):
     return result
 
 
-def get_baselines_from_path(path, order, quiet):
-    '''Extracts the baselines from a given'''
-    repo = Repo(path)
+def get_baselines_from_path(path, order, quiet, jobs=1):
+    '''Extracts the baselines from a given path and its submodules
+    into a BaselineSet. Its order is the one of the main repo.'''
+    repositories = get_repository_tree(path)
+    depths = dict(repositories)
+
+    def get_repo_baselines(repo_path):
+        repo_baselines = get_baselines(get_repo(repo_path))
+        if not quiet:
+            logger.info("Showing repo of order %d in %s, %d baselines:",
+                        order + depths[repo_path], repo_path, len(repo_baselines))
+            for baseline in repo_baselines:
+                logger.info("- %s", baseline)
+        return repo_baselines
+
+    results = walk_repositories(repositories, get_repo_baselines, jobs)
+    baselines = data.BaselineSet()
+    for _, repo_baselines in results:
+        baselines.update(repo_baselines)
     if order == 0:
-        baselines, baseline_order = get_baselines(repo)
-    else:
-        baselines = get_baselines(repo)[0]
-        baseline_order = []
-    if not quiet:
-        logger.info("Showing repo of order %d in %s, %d baselines:",
-                    order, repo.working_tree_dir, len(baselines))
-        for baseline in baselines:
-            logger.info("- %s", baseline)
-    for module in repo.submodules:
-        module_baselines = get_baselines_from_path(
-            module.module().working_tree_dir, order+1, quiet)[0]
-        for key, value in module_baselines.items():
-            if key not in baselines:
-                baselines[key] = []
-            baselines[key].extend(value)
-    return baselines, baseline_order
-
-
-def add_recursive_commit(path, commit_msg, add_newly_created_too=False):
-    '''Adds a given empty commit to a repository and all its submodules'''
-    repo = Repo(os.path.abspath(path))
-    for module in repo.submodules:
-        add_recursive_commit(module.module().working_tree_dir, commit_msg, add_newly_created_too)
-    if add_newly_created_too:
-        repo.git.add('-A')
-        repo.git.commit('--allow-empty', '-m', commit_msg)
-    else:
-        repo.git.commit('--allow-empty', '-a', '-m', commit_msg)
-
-
-def reset_hard_to_baseline(path, baseline):
-    ''' Reset the repo at path to the the commit previous to
-    the one contained in the baseline object for the given path'''
-    repo = Repo(path)
-    for module in repo.submodules:
-        logger.info(module)
-        reset_hard_to_baseline(
-            module.module().working_tree_dir, baseline)
-    repo_commit = None
-    logger.info(baseline)
-    logger.info(path)
-    for baseline_set in baseline:
-        if path in baseline_set:
-            repo_commit = baseline_set[path]
-    if repo_commit is None:
-        # first try and do a full path lookup...
-        abspath = os.path.abspath(path)
-        for baseline_set in baseline:
-            if abspath in baseline_set:
-                repo_commit = baseline_set[abspath]
-        if repo_commit is None:
-            exit_with_error("Could not find baseline commit in repo " + path)
-    logger.info("path: %s", path)
-    logger.info(repo_commit)
-    logger.info(repo_commit.parents)
-    if not repo_commit.parents:
-        exit_with_error("Invalid repo configuration: commit " +
-                        repo_commit + " has no parents!")
-    new_commit = repo_commit.parents[0]
-    logger.info("Resetting to %s", new_commit)
-    repo.git.reset('--hard', new_commit)
+        baselines.order = results[0][1].order
+    return baselines
 
+
+def add_recursive_commit(path, commit_msg, add_newly_created_too=False, jobs=1):
+    '''Adds a given empty commit to a repository and all its submodules'''
+    def commit(repo_path):
+        repo = get_repo(repo_path)
+        previous_head = repo.head.commit.hexsha if repo.head.is_valid() else None
+        if add_newly_created_too:
+            repo.git.add('-A')
+            repo.git.commit('--allow-empty', '-m', commit_msg)
+        else:
+            repo.git.commit('--allow-empty', '-a', '-m', commit_msg)
+        update_baseline_cache(repo, previous_head)
+
+    # submodules are committed first, so the updated
+    # submodule commits get committed in their parents
+    walk_repositories(get_repository_tree(path), commit, jobs, children_first=True)
+
+
+def reset_hard_to_baseline(path, baselines, baseline, jobs=1):
+    ''' Reset the repo at path and all its submodules to the commit
+    previous to the baseline commit of the given baseline'''
+    def reset(repo_path):
+        repo = get_repo(repo_path)
+        baseline_sha = baselines.get(baseline, repo_path)
+        if baseline_sha is None:
+            exit_with_error("Could not find baseline commit in repo " + repo_path)
+        repo_commit = repo.commit(baseline_sha)
+        logger.debug("Baseline %s in %s: %s", baseline, repo_path, baseline_sha)
+        if not repo_commit.parents:
+            exit_with_error("Invalid repo configuration: commit " +
+                            baseline_sha + " has no parents!")
+        new_commit = repo_commit.parents[0]
+        logger.info("Resetting %s to %s", repo_path, new_commit)
+        previous_head = repo.head.commit.hexsha
+        repo.git.reset('--hard', new_commit)
+        cache = read_baseline_cache(repo)
+        if cache is not None and cache["head"] == previous_head:
+            hexshas = [hexsha for hexsha, _ in cache["baselines"]]
+            if baseline_sha in hexshas:
+                # all baselines older than the removed one are still there
+                write_baseline_cache(
+                    repo,
+                    new_commit.hexsha,
+                    cache["baselines"][hexshas.index(baseline_sha) + 1:])
+
+    walk_repositories(get_repository_tree(path), reset, jobs, children_first=True)
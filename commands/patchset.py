@@ -5,7 +5,10 @@ __license__ = "MIT"
 __version__ = "0.1.0"
 __status__ = "Development"
 
+import concurrent.futures
 import datetime
+import hashlib
+import json
 import logging
 import os
 import shutil
@@ -14,14 +17,17 @@ import string
 import copy
 import sys
 import subprocess
+import threading
 import glob
 import click
 import git
 
 import jinja2
 
-from configuration import data
-from shared.helpers import exit_with_error, need_layer_config
+from configuration import data, decode
+from shared.filestore import LINK_MODES, FileStore, file_sha256, place_file
+from shared.helpers import exit_with_error, get_jobs, need_layer_config, remove_empty_folders
+from shared.repos import clear_repos, get_repo, get_repo_key
 
 from commands import baseline
 
@@ -67,17 +73,31 @@ logger = logging.getLogger(__name__)
     multiple=True,
     required=False,
     help='''The patch is NOT included if one or more tags are present here that are configured for the patch.''')
+@click.option(
+    '--incremental', is_flag=True, required=False,
+    type=click.BOOL, default=False,
+    help='''If set, an existing outpath is updated instead of refused: only files that changed since
+    the last incremental run are copied, moved or deleted.''')
+@click.option(
+    '--link_mode', required=False,
+    type=click.Choice(LINK_MODES), default=None,
+    help='''How the patches, scripts and files are placed into the patchset: copy, hardlink,
+    reflink (copy-on-write clone) or symlink. Falls back to a copy where the file system does not
+    support it. Defaults to hardlink for -a and copy otherwise.''')
 @click.argument('outpath', type=click.Path())
 @click.pass_context
-def patchset(ctx, layer, patchdir, scriptdir, filedir, outpath, all_patchsets, filters_include, filters_exclude):
+def patchset(ctx, layer, patchdir, scriptdir, filedir, outpath, all_patchsets, filters_include, filters_exclude,
+             incremental, link_mode):
     '''Create a patchset for a given layer. If "all" is selected: for each full
     path through the tree (e.g. for each leaf) creates a full patchset.'''
     need_layer_config(ctx)
     if all_patchsets:
-        create_all_sets(ctx, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude)
+        create_all_sets(ctx, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude, incremental,
+                        link_mode or "hardlink")
     else:
         if layer:
-            _patchset_internal(ctx, layer, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude)
+            _patchset_internal(ctx, layer, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude,
+                               incremental=incremental, link_mode=link_mode or "copy")
         else:
             exit_with_error("You need to specify either a layer using -l or -a for all layers.")
 
@@ -245,10 +265,48 @@ A patchset creating the following patches was created from the layer definitions
     type=click.STRING,
     default='',
     help='If we are adding baselines, start from this layer.')
-def apply(patch_set, workdir, addbaselines, fromlayer, fixwhitespace):
+@click.option(
+    '--applyMode',
+    required=False,
+    type=click.Choice(['apply', 'am', 'index']),
+    default='apply',
+    help='''How patches are applied: "apply" runs "git apply -3" and a commit for each patch.
+        "am" applies consecutive patches of a repo with a single "git am -3", keeping the
+        author and message of each patch. "index" applies and commits consecutive patches
+        of a repo in a temporary index and updates the working tree once at the end.
+        If "am" or "index" fail, the remaining patches of the batch are applied one by
+        one like with "apply".''')
+@click.option(
+    '--resume',
+    is_flag=True,
+    required=False,
+    type=click.BOOL,
+    default=False,
+    help='''If set, entries of the patchset that a previous run applied are skipped. Each run
+        writes a journal of the applied entries into the git folder of the workdir. Entries
+        are only skipped if their commit is still part of the repo.''')
+@click.pass_context
+def apply(ctx, patch_set, workdir, addbaselines, fromlayer, fixwhitespace, applymode, resume):
     '''Runs the patchset in the given path in
      the provided workdir'''
+    apply_patchset(patch_set, workdir, addbaselines, fromlayer, fixwhitespace, applymode, resume, get_jobs(ctx))
+
+def apply_patchset(patch_set, workdir, addbaselines=False, fromlayer='', fixwhitespace=False,
+                   applymode='apply', resume=False, jobs=1):
+    ''' Applies the patchset in the folder patch_set to the repo(s) in workdir, with the
+    options of the apply command. Only absolute paths derived from the arguments are used,
+    never the current folder, so several threads may call this for different workdirs.
+    Errors exit through exit_with_error, e.g. raise SystemExit in the calling thread.
+    The repositories cached by the calling thread are released afterwards, so a later
+    call sees a workdir that was replaced in between. '''
+    try:
+        apply_patchset_internal(patch_set, workdir, addbaselines, fromlayer, fixwhitespace,
+                                applymode, resume, jobs)
+    finally:
+        clear_repos()
 
+def apply_patchset_internal(patch_set, workdir, addbaselines, fromlayer, fixwhitespace,
+                            applymode, resume, jobs):
     patchset_dir = os.path.abspath(patch_set)
 
     if not os.path.isdir(patchset_dir):
@@ -266,7 +324,6 @@ def apply(patch_set, workdir, addbaselines, fromlayer, fixwhitespace):
     patches = load_patches(patch_set)
     logger.info("Loaded patcheset...")
 
-    previous_work_dir = os.path.abspath(os.getcwd())
     work_dir = os.path.abspath(workdir)
 
     adding_patches = len(fromlayer) == 0
@@ -275,33 +332,182 @@ def apply(patch_set, workdir, addbaselines, fromlayer, fixwhitespace):
     if not os.path.isdir(work_dir):
         exit_with_error("Patch dir invalid")
 
-    for patch in patches.patches:
-        os.chdir(os.path.join(work_dir, patch.basePath))
+    journal = ApplyJournal(work_dir, get_patchset_hash(patchset_dir))
+    applied = {}
+    if resume:
+        applied = journal.get_applied_entries()
+        logger.info("Resuming, %d entries were already applied.", len(applied))
+    journal.start(applied)
+
+    # Patches are queued per repo and the queues are applied in parallel. Baselines,
+    # scripts, copy tasks and patches updating submodules are barriers: all queued
+    # patches are applied before them and nothing after them is applied earlier.
+    queues = {}
+    for index, patch in enumerate(patches.patches):
         if not patch.valid():
             exit_with_error("Invalid patch configuration: " + str(patch))
         if not adding_patches and patch.baseline == fromlayer:
             logger.info("Found start layer! Patching now!")
             adding_patches = True
-        if adding_patches:
-            if patch.is_baseline():
-                add_baseline(work_dir, patch)
-                continue
-            if patch.is_script():
-                add_scripted(work_dir, scripts_dir, patch)
-                continue
-            if patch.is_copy():
-                add_files(work_dir, files_dir, patch)
-                continue
-            #default to patches... this is ok since valid() checks for this.
-            else:
-                add_patches(fixwhitespace, patchset_dir, previous_work_dir, patch)
+        if not adding_patches:
+            continue
+        if index in applied:
+            logger.info("Skipping %s, it was already applied.", describe_entry(patch))
+            continue
+        if patch.is_patch():
+            # "", ".", "./sub" and "sub/" name the same repos, so the queues are keyed by path
+            queues.setdefault(get_repo_key(os.path.join(work_dir, patch.basePath)), []).append((index, patch))
+            if patch.updateModulesAfterPatch:
+                apply_patch_queues(applymode, fixwhitespace, patchset_dir, work_dir, queues, jobs, journal)
+                queues = {}
+            continue
+
+        apply_patch_queues(applymode, fixwhitespace, patchset_dir, work_dir, queues, jobs, journal)
+        queues = {}
+        if patch.is_baseline():
+            add_baseline(work_dir, patch)
+        elif patch.is_script():
+            add_scripted(work_dir, scripts_dir, patch)
+        elif patch.is_copy():
+            add_files(work_dir, files_dir, patch)
+        journal.record(index, patch, get_head(os.path.join(work_dir, patch.basePath)))
+
+    apply_patch_queues(applymode, fixwhitespace, patchset_dir, work_dir, queues, jobs, journal)
+    journal.close()
+
+def apply_patch_queues(applymode, fixwhitespace, patchset_dir, work_dir, queues, jobs, journal):
+    ''' Applies the queued patches of each repo (keyed by the path of the repo) using up to jobs threads.
+    The patches of a repo are applied in order. All failed queues are reported before exiting. '''
+    if jobs <= 1 or len(queues) < 2:
+        for batch in queues.values():
+            add_patch_batch(applymode, fixwhitespace, patchset_dir, work_dir, batch, journal)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(jobs, len(queues))) as executor:
+        futures = {
+            repo_path: executor.submit(
+                add_patch_batch, applymode, fixwhitespace, patchset_dir, work_dir, batch, journal)
+            for repo_path, batch in queues.items()}
+    failed = []
+    for repo_path, future in futures.items():
+        error = future.exception()
+        if error is None:
+            continue
+        base_path = os.path.relpath(repo_path, work_dir)
+        failed.append(base_path)
+        if isinstance(error, SystemExit):
+            # the reason was already logged by exit_with_error
+            logger.error("Patching %s failed!", base_path)
+        else:
+            logger.error("Patching %s failed: %s", base_path, error)
+    if failed:
+        journal.close()
+        exit_with_error("Patching failed in " + ", ".join(failed))
+
 
-        os.chdir(previous_work_dir)
+# Increase this whenever the format of the apply journal changes
+APPLY_JOURNAL_VERSION = 1
+
+def get_patchset_hash(patchset_dir):
+    ''' Returns the hash identifying a patchset in the apply journal '''
+    with open(os.path.join(patchset_dir, "patches.json"), "rb") as patches_file:
+        return hashlib.sha256(patches_file.read()).hexdigest()
+
+def get_head(path):
+    ''' Returns the sha of HEAD of the repo at path or None if path is no repo '''
+    try:
+        return get_repo(path).git.rev_parse('HEAD')
+    except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+        return None
+
+def describe_entry(patch):
+    ''' Returns a short description of a patchset entry '''
+    return patch.patch or patch.baseline or patch.script or patch.copyPattern
+
+class ApplyJournal:
+    ''' Journal of the entries of a patchset that were applied to a workdir. It is kept
+    in the git folder of the workdir (or in a .tuxlayers folder if the workdir only holds
+    the repos of the basePaths) as json lines: a header holding the hash of the
+    patchset, followed by the index, description, basePath and resulting commit of
+    each applied entry. Entries may be recorded from several threads. '''
+
+    def __init__(self, work_dir, patchset_hash):
+        self.work_dir = work_dir
+        self.patchset_hash = patchset_hash
+        try:
+            journal_dir = os.path.join(get_repo(work_dir).git_dir, "tuxlayers")
+        except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError):
+            journal_dir = os.path.join(work_dir, ".tuxlayers")
+        self.journal_file = os.path.join(journal_dir, "apply_journal.jsonl")
+        self.journal = None
+        self.lock = threading.Lock()
+
+    def read(self):
+        ''' Returns the entries of the last run keyed by index, if it applied the same patchset '''
+        entries = {}
+        if not os.path.isfile(self.journal_file):
+            logger.warning("No apply journal found in %s", self.journal_file)
+            return entries
+        with open(self.journal_file, encoding="utf-8") as journal:
+            try:
+                header = json.loads(journal.readline())
+            except ValueError:
+                header = {}
+            if header.get("version") != APPLY_JOURNAL_VERSION or header.get("patchset") != self.patchset_hash:
+                logger.warning("The apply journal belongs to a different patchset, applying all entries.")
+                return entries
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # the last line might be incomplete after a crash
+                entries[entry["index"]] = entry
+        return entries
+
+    def get_applied_entries(self):
+        ''' Returns the journal entries whose commit is still part of the history of their repo '''
+        applied = {}
+        for index, entry in self.read().items():
+            base_path = entry["basePath"]
+            if entry["sha"] is None:
+                # scripts and copy tasks outside of a repo leave no commit to check
+                applied[index] = entry
+                continue
+            try:
+                if get_repo(os.path.join(self.work_dir, base_path)).is_ancestor(entry["sha"], "HEAD"):
+                    applied[index] = entry
+                    continue
+            except git.exc.GitError:
+                pass  # the commit does not exist anymore
+            logger.info("Applying %s again, its commit is not in %s.", entry["patch"], base_path or ".")
+        return applied
+
+    def start(self, entries):
+        ''' Starts a new journal holding the given entries '''
+        os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+        self.journal = open(self.journal_file, "w", encoding="utf-8")
+        self.write({"version": APPLY_JOURNAL_VERSION, "patchset": self.patchset_hash})
+        for index in sorted(entries):
+            self.write(entries[index])
+
+    def record(self, index, patch, sha):
+        ''' Adds an applied entry '''
+        self.write({"index": index, "patch": describe_entry(patch), "basePath": patch.basePath, "sha": sha})
+
+    def write(self, entry):
+        ''' Appends a line to the journal '''
+        with self.lock:
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+
+    def close(self):
+        ''' Closes the journal, it stays for the next run '''
+        with self.lock:
+            self.journal.close()
 
 def add_scripted(work_dir, scripts_dir, script):
     """ Executes a configured script task. """
     logger.info("Found script task in patch config.")
-    previous_work_dir = work_dir
     if not os.path.isdir(scripts_dir):
         exit_with_error("scripts folder missing in patchset!")
     # now we just run the script in the base folder
@@ -314,7 +520,8 @@ def add_scripted(work_dir, scripts_dir, script):
             capture_output = True,
             text = True,
             shell = True,
-            check = True
+            check = True,
+            cwd = os.path.join(work_dir, script.basePath)
         )
 
         print_script_results(script, result.stdout, result.stderr)
@@ -323,10 +530,6 @@ def add_scripted(work_dir, scripts_dir, script):
         logger.error(str(error))
         exit_with_error("Script " + script.script + " returned " + str(error.returncode) + " when running. Exiting!")
 
-    # Just in case the script misbehaved and changed the current folder
-    # lets just return to where we came from...
-    os.chdir(previous_work_dir)
-
     # now, we add commits to all of the repos...
     commitMessage = "Added result of running script " + script.script
     if script.comment:
@@ -358,11 +561,12 @@ def add_files(work_dir, files_dir, files):
     # this is rather staightforward:  just use glob.glob() to recurse through the provided files
     # and then copy this to our workdir (creating folders etc. if needed)
     source_dir = os.path.join(files_dir, files.copySourceDir)
+    target_dir = os.path.join(work_dir, files.basePath)
 
     for file_to_copy in glob.glob(files.copyPattern, recursive=True, root_dir=source_dir):
         if os.path.isfile(os.path.join(source_dir, file_to_copy)):
-            os.makedirs(os.path.join(".", os.path.dirname(file_to_copy)), exist_ok=True)
-            shutil.copy(os.path.join(source_dir, file_to_copy), os.path.join(".", file_to_copy))
+            os.makedirs(os.path.join(target_dir, os.path.dirname(file_to_copy)), exist_ok=True)
+            shutil.copy(os.path.join(source_dir, file_to_copy), os.path.join(target_dir, file_to_copy))
 
     # now, we add commits to all of the repos...
     commitMessage = "Added result copy command from folder " + files.copySourceDir + " with pattern " + files.copyPattern
@@ -379,9 +583,85 @@ def add_baseline(work_dir, patch):
     logger.info("Found baseline in patch config.")
     baseline.add_baseline_internal(work_dir, patch.baseline)
 
-def add_patches(fixwhitespace, patchset_dir, previous_work_dir, patch):
+def add_patch_batch(applymode, fixwhitespace, patchset_dir, work_dir, entries, journal):
+    ''' Applies consecutive patches of the same repo, given as (index, patch) tuples,
+    and records them in the journal. '''
+    patches = [patch for _, patch in entries]
+    repo = get_repo(os.path.join(work_dir, patches[0].basePath))
+    head = repo.git.rev_parse('HEAD')
+    applied = 0
+    if applymode == 'am':
+        applied = add_patches_with_am(patchset_dir, repo, patches)
+    elif applymode == 'index':
+        applied = add_patches_in_index(patchset_dir, repo, patches)
+    if applied:
+        commits = repo.git.rev_list(['--reverse', head + '..HEAD']).split()
+        for (index, patch), commit in zip(entries, commits):
+            journal.record(index, patch, commit)
+    for index, patch in entries[applied:]:
+        add_patches(fixwhitespace, patchset_dir, repo, patch)
+        journal.record(index, patch, repo.git.rev_parse('HEAD'))
+
+def add_patches_with_am(patchset_dir, repo, patches):
+    ''' Applies patches with a single "git am -3" and returns how many of them were applied. '''
+    patch_files = [os.path.join(patchset_dir, patch.patch) for patch in patches]
+    logger.info("Running %d patches with git am in %s!", len(patches), repo.working_tree_dir)
+    head = repo.git.rev_parse('HEAD')
+    try:
+        repo.git.am(['-3', *patch_files])
+        return len(patches)
+    except git.exc.GitError as error:
+        logger.info("git am stopped, applying the remaining patches one by one: %s", error)
+    # keep the commits git am made and drop what is left of the failed patch
+    try:
+        repo.git.am('--quit')
+    except git.exc.GitError:
+        pass  # git am failed before starting
+    repo.git.reset(['--merge', 'HEAD'])
+    return int(repo.git.rev_list(['--count', head + '..HEAD']))
+
+def add_patches_in_index(patchset_dir, repo, patches):
+    ''' Applies and commits patches in a temporary index without touching the working tree.
+    The working tree is updated once at the end. Returns how many patches were applied. '''
+    logger.info("Running %d patches in a temporary index in %s!", len(patches), repo.working_tree_dir)
+    head = repo.git.rev_parse('HEAD')
+    commit = head
+    applied = 0
+    index_file = os.path.join(
+        repo.git_dir, "tuxlayers_index_" + str(os.getpid()) + "_" + str(threading.get_ident()))
+    env = {"GIT_INDEX_FILE": index_file}
+    try:
+        repo.git.read_tree(head, env=env)
+        for patch in patches:
+            patch_file = os.path.join(patchset_dir, patch.patch)
+            try:
+                repo.git.apply(['--cached', '-3', patch_file], env=env)
+            except git.exc.GitError as error:
+                logger.info("Applying %s to the index failed, applying the remaining patches one by one: %s",
+                            patch.patch, error)
+                break
+            tree = repo.git.write_tree(env=env)
+            if tree == repo.git.rev_parse(commit + "^{tree}"):
+                # leave empty patches to the commit handling of add_patches
+                break
+            commit = repo.git.commit_tree([tree, '-p', commit, '-m', "Applied patch " + patch.patch])
+            applied += 1
+    finally:
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    if commit != head:
+        try:
+            # a two-way merge keeps unrelated local changes, like a checkout would
+            repo.git.read_tree(['-m', '-u', head, commit])
+        except git.exc.GitError as error:
+            logger.info("Updating the working tree failed, applying the patches one by one: %s", error)
+            return 0
+        repo.git.update_ref(['-m', "tuxlayers: applied " + str(applied) + " patches", 'HEAD', commit, head])
+    return applied
+
+def add_patches(fixwhitespace, patchset_dir, repo, patch):
     try:
-        repo = git.Repo(".")
         patch_file = os.path.join(os.path.abspath(patchset_dir), patch.patch)
         logger.info("Running patch %s!", patch.patch)
         if not fixwhitespace:
@@ -405,7 +685,6 @@ def add_patches(fixwhitespace, patchset_dir, previous_work_dir, patch):
                 repo.git.commit(['-m', '--allow-empty',  "Applied patch " + patch.patch])
 
     except git.exc.GitError as error:
-        os.chdir(previous_work_dir)
         exit_with_error("Git error: " + str(error))
 
 
@@ -422,21 +701,29 @@ def get_all_referred_layers(layer, tree):
         node = tree.parent(node.identifier)
     return reversed(layers)
 
-def create_all_sets(ctx, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude):
+def create_all_sets(ctx, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude,
+                    incremental=False, link_mode="hardlink"):
     """For each full path through the tree
     (e.g. for each leaf) creates a full patchset"""
 
-    if os.path.exists(outpath):
+    if os.path.exists(outpath) and not incremental:
         exit_with_error("Outpath may not exist: " + outpath)
 
     tree = ctx.obj['LAYER_TREE']
+    # the leaves share most of their files, so each file is only copied once
+    # into a content-addressed store and hard linked (or cloned) into the patchsets
+    store = None
+    if link_mode in ("hardlink", "reflink"):
+        store = FileStore(os.path.join(outpath, ".tuxlayers_store"), link_mode)
     for leaf in tree.leaves():
         logger.info("Creating patchset for leaf %s", leaf.identifier)
         _patchset_internal(ctx, leaf.identifier, patchdir,
                            scriptdir, filedir,
                            os.path.join(outpath, leaf.identifier),
-                           filters_include, filters_exclude)
+                           filters_include, filters_exclude, store, incremental, link_mode)
         logger.info("Done!")
+    if store is not None:
+        store.remove()
     logger.info("Created %d full patchsets", len(tree.leaves()))
 
 
@@ -492,19 +779,23 @@ def create_patchset(ctx, layer, filters_include, filters_exclude):
 
     return patch_set
 
-def _patchset_internal(ctx, layer, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude):
-    '''Create a patchset for a given layer.'''
-    if os.path.exists(outpath):
+def _patchset_internal(ctx, layer, patchdir, scriptdir, filedir, outpath, filters_include, filters_exclude,
+                       store=None, incremental=False, link_mode="copy"):
+    '''Create a patchset for a given layer. If a FileStore is given, files are linked from it,
+    otherwise they are placed using link_mode. If incremental is set, an existing patchset in
+    outpath is updated.'''
+    if os.path.exists(outpath) and not incremental:
         exit_with_error("Outpath may not exist: " + outpath)
 
     patch_set = create_patchset(ctx, layer, filters_include, filters_exclude)
     # write patch info file to our folder...
     logger.info("Creating output folder %s", outpath)
-    os.makedirs(outpath)
+    os.makedirs(outpath, exist_ok=incremental)
     # fetch the patches and copy them to the outpath.
     # Rename patches in order and update the patch_set info
     logger.info("Collecting patches...")
-    patch_set = collect_patches(patchdir, patch_set, outpath, filedir, scriptdir)
+    patch_set = collect_patches(patchdir, patch_set, outpath, filedir, scriptdir, store, incremental,
+                                get_jobs(ctx), link_mode)
 
     logger.info("Writing patch file...")
     with open(os.path.join(outpath, "patches.json"), "w", encoding="utf-8") as outfile:
@@ -516,76 +807,223 @@ def _patchset_internal(ctx, layer, patchdir, scriptdir, filedir, outpath, filter
     create_run_patches(patch_set, outpath)
 
 
-def collect_patches(patchdir, patch_set, target_path, file_dir, script_dir):
+def collect_patches(patchdir, patch_set, target_path, file_dir, script_dir, store=None, incremental=False,
+                    jobs=1, link_mode="copy"):
     """Collects the patch files, renames them in order
     and updates their information in the patch_set.
     Returns a (deep) copy of the patch_set with modified
-    filenames."""
-    current_index = 1
-
+    filenames. In incremental mode only the files that
+    changed since the last run are updated. Files are
+    placed with link_mode using up to jobs threads."""
     if not os.path.exists(patchdir):
         exit_with_error("Patchdir not found: " + patchdir)
     if not os.path.exists(target_path):
         exit_with_error("Target path not found: " + target_path)
+    patch_set_copy, copies = plan_patchset_files(patchdir, patch_set, file_dir, script_dir)
+    if incremental:
+        update_patchset_files(target_path, copies, store, jobs, link_mode)
+    else:
+        copy_files(target_path, copies, store, jobs, link_mode)
+        # without digests, the next incremental run hashes the files it cannot keep by their stat
+        write_manifest(target_path, {target: get_manifest_entry(source, link_mode)
+                                     for target, source in copies.items()})
+    return patch_set_copy
+
+def plan_patchset_files(patchdir, patch_set, file_dir, script_dir):
+    """Returns a (deep) copy of the patch_set with the renamed patch files and
+    the files of the patchset as a dict of target (relative to the patchset
+    folder) to source. Patches are numbered in their order, so each gets its own
+    file. If a file or script is collected twice, the last source wins."""
+    current_index = 1
+    copies = {}
     # First, make a deep copy of the patch_set so we dont keep the modified filenames
     patch_set_copy = copy.deepcopy(patch_set)
     for patch in patch_set_copy.patches:
         if patch.is_baseline():
             continue
         if patch.is_script():
-            collect_script(target_path, script_dir, patch)
+            collect_script(copies, script_dir, patch)
 
             continue
         if patch.is_copy():
-            collect_files(target_path, file_dir, patch)
+            collect_files(copies, file_dir, patch)
 
             continue
         #default: patch...
-        collect_patch(patchdir, target_path, current_index, patch)
-    return patch_set_copy
+        current_index = collect_patch(patchdir, copies, current_index, patch)
+    return patch_set_copy, copies
 
-def collect_patch(patchdir, target_path, current_index, patch):
+def collect_patch(patchdir, copies, current_index, patch):
+    '''Plans the copy of a patch, prefixed with current_index. Returns the next index.'''
     patch_path = os.path.dirname(patch.patch)
     patch_filename = os.path.basename(patch.patch)
-    os.makedirs(os.path.join(target_path, patch.basePath), exist_ok=True)
     new_filename = os.path.join(patch.basePath, str(
             current_index).zfill(5) + "_" + patch_filename)
-    try:
-        shutil.copy(
-                os.path.join(patchdir, patch_path, patch_filename),
-                os.path.join(target_path, new_filename))
-    except FileNotFoundError as error:
-        exit_with_error(error)
+    source = os.path.join(patchdir, patch_path, patch_filename)
+    if not os.path.isfile(source):
+        exit_with_error("Patch not found: " + source)
+    copies[os.path.normpath(new_filename)] = source
     patch.patch = new_filename
-    current_index += 1
+    return current_index + 1
 
-def collect_files(target_path, file_dir, patch):
+def collect_files(copies, file_dir, patch):
     source_dir = os.path.join(file_dir, patch.copySourceDir)
-    target_dir = os.path.join(target_path, "files", patch.copySourceDir)
-            #scripts_dir = os.path.join(patchset_dir, "scripts")
+    target_dir = os.path.join("files", patch.copySourceDir)
 
     for file_to_copy in glob.glob(patch.copyPattern, recursive=True, root_dir=source_dir):
         if os.path.isfile(os.path.join(source_dir, file_to_copy)):
-            os.makedirs(os.path.join(target_dir, os.path.dirname(file_to_copy)), exist_ok=True)
             logger.info("Copying file %s ...", file_to_copy)
-            shutil.copy(os.path.join(source_dir, file_to_copy), os.path.join(target_dir, file_to_copy))
+            copies[os.path.normpath(os.path.join(target_dir, file_to_copy))] = os.path.join(source_dir, file_to_copy)
 
-def collect_script(target_path, script_dir, patch):
+def collect_script(copies, script_dir, patch):
     source_dir = script_dir
-    target_dir = os.path.join(target_path, "scripts")
+    target_dir = "scripts"
     if os.path.isfile(os.path.join(source_dir, patch.script)):
-        os.makedirs(os.path.join(target_dir, os.path.dirname(patch.script)), exist_ok=True)
         logger.info("Copying script %s ...", patch.script)
-        shutil.copy(os.path.join(source_dir, patch.script), os.path.join(target_dir, patch.script))
+        copies[os.path.normpath(os.path.join(target_dir, patch.script))] = os.path.join(source_dir, patch.script)
     logger.info(patch)
     for resource in patch.scriptResources:
         logger.info(resource)
         logger.info(glob.glob(resource, recursive=True, root_dir=source_dir))
         for resource_to_copy in glob.glob(resource, recursive=True, root_dir=source_dir):
             if os.path.isfile(os.path.join(source_dir, resource_to_copy)):
-                os.makedirs(os.path.join(target_dir, os.path.dirname(resource_to_copy)), exist_ok=True)
                 logger.info("Copying script resource %s ...", resource_to_copy)
-                shutil.copy(os.path.join(source_dir, resource_to_copy), os.path.join(target_dir, resource_to_copy))
+                copies[os.path.normpath(os.path.join(target_dir, resource_to_copy))] = \
+                    os.path.join(source_dir, resource_to_copy)
+
+
+# Increase this whenever the format of the patchset manifest changes
+MANIFEST_VERSION = 1
+MANIFEST_FILE = ".tuxlayers_manifest.json"
+
+def read_manifest(target_path):
+    """Returns the files copied by the last run into target_path, keyed by their
+    path relative to it, or None if there is no valid manifest"""
+    manifest_file = os.path.join(target_path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_file):
+        logger.info("No manifest found in %s, copying all files and deleting the others.", target_path)
+        return None
+    try:
+        with open(manifest_file, encoding="utf-8") as manifest_content:
+            manifest = json.load(manifest_content)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest["files"]
+    except (OSError, ValueError, KeyError) as error:
+        logger.warning("Ignoring invalid manifest %s: %s", manifest_file, error)
+        return None
+
+def write_manifest(target_path, files):
+    """Stores the files of the patchset in target_path for the next incremental run"""
+    manifest_file = os.path.join(target_path, MANIFEST_FILE)
+    temp_file = manifest_file + "." + str(os.getpid()) + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as manifest_content:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, manifest_content, indent=1, sort_keys=True)
+    os.replace(temp_file, manifest_file)
+
+def get_manifest_entry(source, link_mode, sha256=None):
+    """Returns the manifest entry of a file placed from source"""
+    source_stat = os.stat(source)
+    return {"source": os.path.abspath(source), "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns, "link_mode": link_mode, "sha256": sha256}
+
+def list_patchset_files(target_path):
+    """Returns the paths (relative to target_path) of all files in target_path
+    except the ones written for the patchset itself"""
+    own_files = {"patches.json", "runPatches.sh", MANIFEST_FILE}
+    files = []
+    for folder, _, filenames in os.walk(target_path):
+        for filename in filenames:
+            target = os.path.relpath(os.path.join(folder, filename), target_path)
+            if target not in own_files:
+                files.append(target)
+    return files
+
+def update_patchset_files(target_path, copies, store=None, jobs=1, link_mode="copy"):
+    """Updates the files of the patchset in target_path to copies (target -> source).
+    Files whose source and link_mode did not change (same path, size and mtime or
+    same sha256) are kept. Files of the last run that are not needed anymore are moved to a
+    target needing the same content or deleted. Everything else is copied. Without a
+    manifest, all files of an earlier patchset in target_path (one with a patches.json)
+    that are not part of copies are deleted; other folders that are not empty are refused."""
+    previous = read_manifest(target_path)
+    if previous is None:
+        # only clean up a folder that holds an earlier patchset, never e.g. a mistyped outpath
+        if os.listdir(target_path) and not os.path.isfile(os.path.join(target_path, "patches.json")):
+            exit_with_error("Outpath is neither empty nor a patchset: " + target_path)
+        previous = {target: {} for target in list_patchset_files(target_path) if target not in copies}
+    stale = {target: entry for target, entry in previous.items() if target not in copies}
+    # symlinks follow their source, so their content may not match the manifest anymore
+    stale_by_digest = {entry["sha256"]: target for target, entry in stale.items()
+                       if entry.get("sha256")
+                       and os.path.isfile(os.path.join(target_path, target))
+                       and not os.path.islink(os.path.join(target_path, target))}
+    files = {}
+    to_copy = {}
+    kept = moved = 0
+    for target, source in copies.items():
+        target_file = os.path.join(target_path, target)
+        entry = get_manifest_entry(source, link_mode)
+        last = previous.get(target)
+        unchanged = (last is not None and os.path.isfile(target_file)
+                     and last.get("link_mode", link_mode) == link_mode)
+        if unchanged and all(last.get(key) == entry[key] for key in ("source", "size", "mtime_ns")):
+            entry["sha256"] = last.get("sha256")
+        else:
+            entry["sha256"] = file_sha256(source)
+            unchanged = unchanged and last.get("sha256") == entry["sha256"]
+        files[target] = entry
+        if unchanged:
+            kept += 1
+            continue
+
+        # never write into an existing file, it might be linked into other patchsets
+        if os.path.lexists(target_file):
+            os.remove(target_file)
+        stale_target = stale_by_digest.pop(entry["sha256"], None)
+        if stale_target is not None:
+            logger.debug("Moving %s to %s", stale_target, target)
+            os.makedirs(os.path.dirname(target_file), exist_ok=True)
+            os.replace(os.path.join(target_path, stale_target), target_file)
+            del stale[stale_target]
+            moved += 1
+        else:
+            to_copy[target] = source
+
+    copy_files(target_path, to_copy, store, jobs, link_mode)
+    for target in stale:
+        logger.debug("Deleting %s", target)
+        if os.path.lexists(os.path.join(target_path, target)):
+            os.remove(os.path.join(target_path, target))
+    remove_empty_folders(target_path, False)
+    write_manifest(target_path, files)
+    logger.info("Updated patchset files: %d kept, %d moved, %d copied, %d deleted",
+                kept, moved, len(to_copy), len(stale))
+
+def copy_files(target_path, copies, store=None, jobs=1, link_mode="copy"):
+    '''Copies files (target relative to target_path -> source) using up to jobs
+    threads. The target folders are created once before.'''
+    for folder in sorted({os.path.dirname(os.path.join(target_path, target)) for target in copies}):
+        os.makedirs(folder, exist_ok=True)
+
+    def copy_one(target_and_source):
+        target, source = target_and_source
+        copy_file(source, os.path.join(target_path, target), store, link_mode)
+
+    if jobs <= 1 or len(copies) < 2:
+        for target_and_source in copies.items():
+            copy_one(target_and_source)
+    else:
+        # map raises the first error in the order of the copies
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(copy_one, copies.items()))
+
+def copy_file(source, target, store=None, link_mode="copy"):
+    '''Copies source to target, through the file store if one is given'''
+    if store is None:
+        place_file(source, target, link_mode)
+    else:
+        store.link(source, target)
 
 
 # we need this since we want $ in our resulting file...
@@ -647,8 +1085,7 @@ def load_patches(_patchset):
         # Further file processing goes here
         data_json = json_content.read()
         try:
-            # pylint: disable=no-member
-            data_layer = data.PatchSet.from_json(data_json)
+            data_layer = decode.patch_set_from_json(data_json)
             return data_layer
         except ValueError as value_error:
             exit_with_error(value_error)
@@ -0,0 +1,164 @@
+"""Unit tests for creating and applying patchsets"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import json
+import os
+import shutil
+
+import pytest
+
+git = pytest.importorskip("git")
+pytest.importorskip("jinja2")
+
+# pylint: disable=wrong-import-position
+from commands.patchset import apply_patchset, collect_patches, plan_patchset_files
+from configuration import data
+
+
+@pytest.fixture(name="git_identity")
+def fixture_git_identity(monkeypatch):
+    """Commits made by the tests need an author"""
+    for variable in ("GIT_AUTHOR", "GIT_COMMITTER"):
+        monkeypatch.setenv(variable + "_NAME", "Test")
+        monkeypatch.setenv(variable + "_EMAIL", "test@example.com")
+
+
+def create_patchset(tmp_path):
+    """Returns an origin repo and a patchset with a patch and a baseline for it"""
+    origin = git.Repo.init(tmp_path / "origin")
+    (tmp_path / "origin" / "README").write_text("base\n")
+    origin.index.add(["README"])
+    origin.index.commit("base")
+    (tmp_path / "origin" / "README").write_text("patched\n")
+    origin.git.commit(["-a", "-m", "patched"])
+    patchset_dir = tmp_path / "patchset"
+    patchset_dir.mkdir()
+    origin.git.format_patch(["-1", "-o", str(patchset_dir)])
+    origin.git.reset(["--hard", "HEAD~1"])
+    patch_file = [path.name for path in patchset_dir.iterdir()][0]
+    (patchset_dir / "patches.json").write_text(json.dumps(
+        {"patches": [{"basePath": "", "patch": patch_file},
+                     {"basePath": "", "patch": "", "baseline": "layer"}]}))
+    return origin, patchset_dir
+
+
+@pytest.mark.usefixtures("git_identity")
+def test_apply_to_recloned_workdir(tmp_path):
+    """A workdir replaced between two runs in one process is read from disk again"""
+    origin, patchset_dir = create_patchset(tmp_path)
+    work_dir = tmp_path / "work"
+    for run in range(2):
+        # the second clone holds commits the first one did not know
+        (tmp_path / "origin" / ("run" + str(run))).write_text("new\n")
+        origin.index.add(["run" + str(run)])
+        origin.index.commit("run " + str(run))
+        shutil.rmtree(work_dir, ignore_errors=True)
+        origin.clone(str(work_dir))
+        apply_patchset(str(patchset_dir), str(work_dir))
+        assert (work_dir / "README").read_text() == "patched\n"
+        assert len(list(git.Repo(work_dir).iter_commits())) == run + 4
+
+
+@pytest.mark.usefixtures("git_identity")
+def test_apply_to_folder_holding_repos(tmp_path):
+    """A workdir that only holds the repos of the basePaths keeps its journal in .tuxlayers"""
+    origin, patchset_dir = create_patchset(tmp_path)
+    patch_file = json.loads((patchset_dir / "patches.json").read_text())["patches"][0]["patch"]
+    (patchset_dir / "patches.json").write_text(json.dumps(
+        {"patches": [{"basePath": "a", "patch": patch_file}]}))
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    origin.clone(str(work_dir / "a"))
+
+    apply_patchset(str(patchset_dir), str(work_dir))
+    assert (work_dir / "a" / "README").read_text() == "patched\n"
+    assert (work_dir / ".tuxlayers" / "apply_journal.jsonl").is_file()
+
+    apply_patchset(str(patchset_dir), str(work_dir), resume=True)
+    assert len(list(git.Repo(work_dir / "a").iter_commits())) == 2
+
+
+@pytest.mark.usefixtures("git_identity")
+def test_apply_queues_spellings_of_a_repo_together(tmp_path):
+    """Patches for "", "." and "./" of one repo are applied in order by a single queue"""
+    origin = git.Repo.init(tmp_path / "origin")
+    (tmp_path / "origin" / "README").write_text("0\n")
+    origin.index.add(["README"])
+    origin.index.commit("base")
+    for number in range(1, 4):
+        (tmp_path / "origin" / "README").write_text(str(number) + "\n")
+        origin.git.commit(["-a", "-m", "step " + str(number)])
+    patchset_dir = tmp_path / "patchset"
+    patchset_dir.mkdir()
+    patch_files = origin.git.format_patch(["-3", "-o", str(patchset_dir)]).split()
+    origin.git.reset(["--hard", "HEAD~3"])
+    (patchset_dir / "patches.json").write_text(json.dumps({"patches": [
+        {"basePath": base_path, "patch": os.path.basename(patch_file)}
+        for base_path, patch_file in zip(["", ".", "./"], patch_files)]}))
+    work_dir = tmp_path / "work"
+    origin.clone(str(work_dir))
+
+    apply_patchset(str(patchset_dir), str(work_dir), jobs=2)
+
+    assert (work_dir / "README").read_text() == "3\n"
+    assert len(list(git.Repo(work_dir).iter_commits())) == 4
+
+
+def test_incremental_run_deletes_removed_files(tmp_path):
+    """An incremental run over the output of a plain run deletes the files the layers dropped"""
+    (tmp_path / "patches").mkdir()
+    (tmp_path / "files" / "f").mkdir(parents=True)
+    (tmp_path / "files" / "f" / "one.txt").write_text("one")
+    patch_set = data.PatchSet(patches=[
+        data.PatchConfig(basePath="", patch="", copyPattern="**/*", copySourceDir="f")])
+    out = tmp_path / "out"
+    out.mkdir()
+    collect_patches(str(tmp_path / "patches"), patch_set, str(out), str(tmp_path / "files"), "")
+
+    (tmp_path / "files" / "f" / "one.txt").unlink()
+    (tmp_path / "files" / "f" / "two.txt").write_text("two")
+    collect_patches(str(tmp_path / "patches"), patch_set, str(out), str(tmp_path / "files"), "",
+                    incremental=True)
+    assert sorted(path.name for path in (out / "files" / "f").iterdir()) == ["two.txt"]
+
+    # without a manifest, everything not planned is removed from an earlier patchset as well
+    (out / ".tuxlayers_manifest.json").unlink()
+    (out / "patches.json").write_text('{"patches": []}')
+    (out / "files" / "f" / "old.txt").write_text("old")
+    collect_patches(str(tmp_path / "patches"), patch_set, str(out), str(tmp_path / "files"), "",
+                    incremental=True)
+    assert sorted(path.name for path in (out / "files" / "f").iterdir()) == ["two.txt"]
+
+
+def test_incremental_run_refuses_other_folders(tmp_path):
+    """An incremental run does not touch a folder that is not empty and holds no patchset"""
+    (tmp_path / "patches").mkdir()
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "notes.txt").write_text("keep")
+    with pytest.raises(SystemExit):
+        collect_patches(str(tmp_path / "patches"), data.PatchSet(), str(out), "", "", incremental=True)
+    assert (out / "notes.txt").read_text() == "keep"
+
+
+def test_patches_with_the_same_name_are_numbered(tmp_path):
+    """Patches sharing a basename get their own index and file in the patchset"""
+    patch_set = data.PatchSet(patches=[
+        data.PatchConfig(basePath="sub", patch="a/fix.patch"),
+        data.PatchConfig(basePath="", patch="", baseline="b"),
+        data.PatchConfig(basePath="sub", patch="b/fix.patch")])
+    patch_dir = str(tmp_path)
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "fix.patch").write_text(folder)
+    patch_set_copy, copies = plan_patchset_files(patch_dir, patch_set, "", "")
+
+    names = [patch.patch for patch in patch_set_copy.patches if patch.is_patch()]
+    assert names == [os.path.join("sub", "00001_fix.patch"), os.path.join("sub", "00002_fix.patch")]
+    assert copies == {names[0]: os.path.join(patch_dir, "a", "fix.patch"),
+                      names[1]: os.path.join(patch_dir, "b", "fix.patch")}
+    assert patch_set.patches[0].patch == "a/fix.patch"
@@ -0,0 +1,105 @@
+'''Persistent cache for parsed layer configurations'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import hashlib
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+# Increase this whenever the cache entries or the cached data classes change in an incompatible way
+CACHE_VERSION = 3
+
+
+def default_cache_file(layers_dir):
+    '''Returns the cache file used for a layers dir: a hidden file next to it'''
+    layers_dir = os.path.abspath(layers_dir)
+    return os.path.join(
+        os.path.dirname(layers_dir),
+        "." + os.path.basename(layers_dir) + ".tuxlayers_cache")
+
+
+def default_header_cache_file(layers_dir):
+    '''Returns the cache file holding only the layer headers used by --lazy,
+    a hidden file next to the layers dir'''
+    layers_dir = os.path.abspath(layers_dir)
+    return os.path.join(
+        os.path.dirname(layers_dir),
+        "." + os.path.basename(layers_dir) + ".tuxlayers_headers")
+
+
+def file_digest(filename):
+    '''Returns the sha256 hex digest of a file's content'''
+    with open(filename, "rb") as content:
+        return hashlib.sha256(content.read()).hexdigest()
+
+
+class LayerCache():
+    '''Keeps parsed layers (or only their headers, see default_header_cache_file) on
+    disk, keyed by their path relative to the layers dir.
+    An entry is reused if the content hash of the file still matches. Timestamps
+    are not trusted: an edit within their resolution (or one restoring the mtime)
+    keeps mtime and size. Everything else is parsed again.'''
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.pending = {}
+        self.modified = False
+        self.hits = 0
+
+    def load(self):
+        '''Reads the cache file. A missing or unreadable cache is treated as empty.'''
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "rb") as cache_content:
+                content = pickle.load(cache_content)
+            if content.get("version") == CACHE_VERSION:
+                self.entries = content["entries"]
+            else:
+                logger.info("Ignoring layer cache %s from another version", self.cache_file)
+        except (OSError, EOFError, AttributeError, ImportError,
+                IndexError, KeyError, pickle.UnpicklingError) as error:
+            logger.warning("Ignoring unreadable layer cache %s: %s", self.cache_file, error)
+            self.entries = {}
+
+    def get(self, layers_dir, layer_file):
+        '''Returns the cached layer for layer_file or None if it needs to be parsed'''
+        entry = self.entries.get(layer_file)
+        digest = file_digest(os.path.join(layers_dir, layer_file))
+        if entry is not None and entry["digest"] == digest:
+            self.hits += 1
+            return entry["layer"]
+        self.pending[layer_file] = {"digest": digest}
+        return None
+
+    def put(self, layer_file, layer):
+        '''Stores a freshly parsed layer for a file previously passed to get()'''
+        entry = self.pending.pop(layer_file)
+        entry["layer"] = layer
+        self.entries[layer_file] = entry
+        self.modified = True
+
+    def save(self, layer_files):
+        '''Writes the cache back if anything changed. Entries for files that
+        are gone are dropped.'''
+        for layer_file in set(self.entries) - set(layer_files):
+            del self.entries[layer_file]
+            self.modified = True
+        if not self.modified:
+            return
+        temp_file = self.cache_file + "." + str(os.getpid()) + ".tmp"
+        try:
+            with open(temp_file, "wb") as cache_content:
+                pickle.dump({"version": CACHE_VERSION, "entries": self.entries},
+                            cache_content, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.cache_file)
+            self.modified = False
+        except OSError as error:
+            logger.warning("Could not write layer cache %s: %s", self.cache_file, error)
@@ -6,13 +6,20 @@ __version__ = "0.1.0"
 __status__ = "Development"
 
 from typing import Dict
+import copy
 import datetime
+import os
+import sys
 
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json
 
+# We keep tens of thousands of PatchConfigs alive, so the heavily used data classes
+# use __slots__ (and no per-instance __dict__). dataclass supports this since python 3.10.
+SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 @dataclass_json
-@dataclass
+@dataclass(**SLOTS)
 class PatchConfig():
     """Contains one patch for a given subdir/path"""
     basePath: str
@@ -76,7 +83,7 @@ class PatchSet():
 
 
 @dataclass_json
-@dataclass
+@dataclass(**SLOTS)
 class PatchLayer():
     """Contains a set of patches belonging together.
     Used by BoardConfiguration."""
@@ -114,6 +121,102 @@ class PatchLayer():
             else:
                 return self.id + "_" + str(index+1)
         return ""
+
+
+class LayerView():
+    """Places a shared layer in the tree under a different id, e.g. once for each
+    parent of a multi-parent layer. Everything but the id is read from the layer."""
+    __slots__ = ("id", "layer")
+
+    def __init__(self, layer, layer_id):
+        self.layer = layer
+        self.id = layer_id
+
+    def __getattr__(self, name):
+        # only called for attributes other than id and layer
+        if name.startswith("__") or name == "layer":
+            raise AttributeError(name)
+        return getattr(self.layer, name)
+
+    def __repr__(self):
+        return "LayerView(id=" + repr(self.id) + ", layer=" + repr(self.layer) + ")"
+
+
+class LazyLayer():
+    """Stands in for a PatchLayer of which only the fields needed to build
+    the layer tree (and to list it) are known, e.g. from the header cache. The
+    complete layer is loaded by calling loader on first access to any other
+    attribute, e.g. patches."""
+    HEADER_FIELDS = {
+        "id": "",
+        "tree_ids": [],
+        "parent": "",
+        "parents": [],
+        "title": "",
+        "description": ""}
+
+    def __init__(self, header, loader):
+        for name, default in self.HEADER_FIELDS.items():
+            setattr(self, name, copy.copy(header.get(name, default)))
+        self._loader = loader
+
+    tree_ids_valid = PatchLayer.tree_ids_valid
+    have_parent = PatchLayer.have_parent
+    is_multi_parent = PatchLayer.is_multi_parent
+    get_id_from_index = PatchLayer.get_id_from_index
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set, e.g. not part of the header
+        if name.startswith("__") or name in ("_loader", "_layer"):
+            raise AttributeError(name)
+        if "_layer" not in self.__dict__:
+            self._layer = self._loader()
+            for field_name in self._layer.__dataclass_fields__:
+                if field_name not in self.HEADER_FIELDS:
+                    setattr(self, field_name, getattr(self._layer, field_name))
+        return getattr(self._layer, name)
+
+@dataclass
+class BaselineSet():
+    """Baselines found in a repository and its submodules. For each baseline name
+    this holds the sha of its baseline commit per repository, keyed by the
+    normalized absolute path of the repository's working tree."""
+    commits: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # baselines of the main repository, newest first
+    order: list[str] = field(default_factory=list)
+
+    @staticmethod
+    def normalize_path(path) -> str:
+        '''Returns the key used for a repository path'''
+        return os.path.normcase(os.path.abspath(path))
+
+    def add(self, name, path, hexsha):
+        '''Adds the baseline commit of a repository'''
+        self.commits.setdefault(name, {})[self.normalize_path(path)] = hexsha
+
+    def get(self, name, path) -> str:
+        '''Returns the sha of the baseline commit in the repository at path or None'''
+        return self.commits.get(name, {}).get(self.normalize_path(path))
+
+    def repositories(self, name) -> Dict[str, str]:
+        '''Returns the baseline commits of a baseline keyed by repository path'''
+        return self.commits.get(name, {})
+
+    def update(self, other):
+        '''Adds all baseline commits of another set (e.g. of a submodule)'''
+        for name, repositories in other.commits.items():
+            self.commits.setdefault(name, {}).update(repositories)
+
+    def __contains__(self, name) -> bool:
+        return name in self.commits
+
+    def __iter__(self):
+        return iter(self.commits)
+
+    def __len__(self) -> int:
+        return len(self.commits)
+
+
 @dataclass
 class PatchInfo():
     '''Collects information about a patch file'''
@@ -0,0 +1,108 @@
+'''Fast decoding of layer and patchset json files.
+
+dataclasses_json decodes via reflection on every call which dominates
+loading large layer sets. The functions here build the data classes
+directly from the parsed json, using orjson if it is installed and the
+json module of the standard library otherwise. Like dataclasses_json,
+unknown keys are ignored and missing required keys raise a KeyError.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import dataclasses
+import json
+import sys
+
+from configuration.data import LazyLayer, PatchConfig, PatchLayer, PatchSet
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def _field_names(cls):
+    return frozenset(field.name for field in dataclasses.fields(cls))
+
+
+def _required_names(cls):
+    return tuple(
+        field.name for field in dataclasses.fields(cls)
+        if field.default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING)
+
+
+PATCH_CONFIG_FIELDS = _field_names(PatchConfig)
+PATCH_CONFIG_REQUIRED = _required_names(PatchConfig)
+PATCH_LAYER_FIELDS = _field_names(PatchLayer)
+PATCH_SET_FIELDS = _field_names(PatchSet)
+
+
+# Values repeated across many patches are interned so they are kept only once
+PATCH_CONFIG_INTERNED = frozenset(["basePath", "tags", "copySourceDir"])
+
+
+def patch_config_from_dict(patch_dict):
+    '''Creates a PatchConfig from its decoded json object'''
+    for name in PATCH_CONFIG_REQUIRED:
+        if name not in patch_dict:
+            raise KeyError(name)
+    kwargs = {name: value for name, value in patch_dict.items() if name in PATCH_CONFIG_FIELDS}
+    for name in PATCH_CONFIG_INTERNED.intersection(kwargs):
+        if isinstance(kwargs[name], str):
+            kwargs[name] = sys.intern(kwargs[name])
+    return PatchConfig(**kwargs)
+
+
+def _patches_from_list(patch_list):
+    if patch_list is None:
+        return None
+    return [patch_config_from_dict(patch_dict) for patch_dict in patch_list]
+
+
+def patch_layer_from_dict(layer_dict):
+    '''Creates a PatchLayer from its decoded json object'''
+    kwargs = {name: value for name, value in layer_dict.items() if name in PATCH_LAYER_FIELDS}
+    if "patches" in kwargs:
+        kwargs["patches"] = _patches_from_list(kwargs["patches"])
+    return PatchLayer(**kwargs)
+
+
+def layer_header_from_dict(layer_dict):
+    '''Returns the entries of a layer (given as dict) needed to place it in the layer tree
+    (see LazyLayer.HEADER_FIELDS). Raises a ValueError if one of them has the wrong type.'''
+    if not isinstance(layer_dict, dict):
+        raise ValueError("Layer configuration is not a json object")
+    header = {}
+    for name, default in LazyLayer.HEADER_FIELDS.items():
+        if name not in layer_dict:
+            continue
+        value = layer_dict[name]
+        if isinstance(default, list):
+            valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        else:
+            valid = isinstance(value, str)
+        if not valid:
+            raise ValueError("Invalid value for " + name + " in layer configuration: " + repr(value))
+        header[name] = value
+    return header
+
+
+def patch_set_from_dict(set_dict):
+    '''Creates a PatchSet from its decoded json object'''
+    kwargs = {name: value for name, value in set_dict.items() if name in PATCH_SET_FIELDS}
+    if "patches" in kwargs:
+        kwargs["patches"] = _patches_from_list(kwargs["patches"])
+    return PatchSet(**kwargs)
+
+
+def patch_layer_from_json(content):
+    '''Fast replacement for PatchLayer.from_json'''
+    return patch_layer_from_dict(loads(content))
+
+
+def patch_set_from_json(content):
+    '''Fast replacement for PatchSet.from_json'''
+    return patch_set_from_dict(loads(content))
@@ -0,0 +1,79 @@
+"""Unit tests for the layer cache"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import json
+import os
+import types
+
+import pytest
+
+from configuration.cache import LayerCache, default_header_cache_file
+
+
+def test_cache_detects_edit_keeping_mtime_and_size(tmp_path):
+    """An edit that keeps mtime and size of a layer file is not taken from the cache"""
+    layers_dir = tmp_path / "layers"
+    layers_dir.mkdir()
+    layer_file = layers_dir / "m.json"
+    layer_file.write_text('{"id": "M2"}')
+    cache_file = str(tmp_path / "cache")
+
+    cache = LayerCache(cache_file)
+    cache.load()
+    assert cache.get(str(layers_dir), "m.json") is None
+    cache.put("m.json", "M2")
+    cache.save(["m.json"])
+
+    cache = LayerCache(cache_file)
+    cache.load()
+    assert cache.get(str(layers_dir), "m.json") == "M2"
+
+    stat = os.stat(layer_file)
+    layer_file.write_text('{"id": "M3"}')
+    os.utime(layer_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get(str(layers_dir), "m.json") is None
+    cache.put("m.json", "M3")
+    assert cache.hits == 1
+
+
+def test_lazy_mode_only_decodes_the_used_branch(tmp_path, monkeypatch):
+    """With the header cache, layers off the branch a command uses are never decoded"""
+    for module in ("click", "coloredlogs", "git", "jinja2", "treelib", "dataclasses_json"):
+        pytest.importorskip(module)
+    # pylint: disable=import-outside-toplevel
+    import tuxlayers
+    from commands.patchset import get_all_referred_layers
+    from configuration.decode import patch_layer_from_json
+
+    layers_dir = tmp_path / "layers"
+    layers_dir.mkdir()
+    for layer_id, parent in (("root", ""), ("a", "root"), ("b", "root"), ("c", "a")):
+        (layers_dir / (layer_id + ".json")).write_text(json.dumps(
+            {"id": layer_id, "parent": parent, "patches": [{"basePath": "", "patch": layer_id + ".patch"}]}))
+    decoded = []
+
+    def decode(content):
+        layer = patch_layer_from_json(content)
+        decoded.append(layer.id)
+        return layer
+    monkeypatch.setattr(tuxlayers, "patch_layer_from_json", decode)
+
+    def parse_tree():
+        ctx = types.SimpleNamespace(obj={
+            "LAYER_SOURCE": str(layers_dir), "LAZY": True, "JOBS": 1,
+            "LAYER_CACHE": default_header_cache_file(str(layers_dir))})
+        return tuxlayers.parse_tree_from_layers(ctx)
+
+    parse_tree()
+    assert sorted(decoded) == ["a", "b", "c", "root"]
+
+    decoded.clear()
+    tree = parse_tree()
+    assert not decoded
+    patches = [patch.patch for layer in get_all_referred_layers("c", tree) for patch in layer.patches]
+    assert patches == ["root.patch", "a.patch", "c.patch"]
+    assert sorted(decoded) == ["a", "c", "root"]
@@ -0,0 +1,50 @@
+"""Unit tests for the shared data classes"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import os
+
+import pytest
+
+pytest.importorskip("dataclasses_json")
+
+# pylint: disable=wrong-import-position
+from configuration.data import BaselineSet
+
+
+def test_baseline_set_lookup():
+    """Baseline commits are found by name and normalized repository path"""
+    baselines = BaselineSet()
+    baselines.add("b1", "/repo", "a" * 40)
+    baselines.add("b1", "/repo/sub/", "b" * 40)
+    baselines.add("b2", "/repo/sub/../sub", "c" * 40)
+
+    assert "b1" in baselines
+    assert "b3" not in baselines
+    assert list(baselines) == ["b1", "b2"]
+    assert len(baselines) == 2
+    assert baselines.get("b1", "/repo/") == "a" * 40
+    assert baselines.get("b1", "/repo/sub") == "b" * 40
+    assert baselines.get("b2", "/repo/sub") == "c" * 40
+    assert baselines.get("b2", "/repo") is None
+    assert baselines.get("b3", "/repo") is None
+    assert baselines.repositories("b1") == {
+        os.path.normcase("/repo"): "a" * 40,
+        os.path.normcase("/repo/sub"): "b" * 40}
+
+
+def test_baseline_set_update():
+    """Baselines of submodules are merged into the ones of the main repo"""
+    baselines = BaselineSet(order=["b2", "b1"])
+    baselines.add("b1", "/repo", "a" * 40)
+    sub_baselines = BaselineSet(order=["b1", "b0"])
+    sub_baselines.add("b1", "/repo/sub", "b" * 40)
+    sub_baselines.add("b0", "/repo/sub", "c" * 40)
+    baselines.update(sub_baselines)
+
+    assert baselines.order == ["b2", "b1"]
+    assert baselines.get("b1", "/repo/sub") == "b" * 40
+    assert baselines.get("b0", "/repo/sub") == "c" * 40
@@ -0,0 +1,73 @@
+"""Unit tests for the fast json decoding"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import json
+
+import pytest
+
+pytest.importorskip("dataclasses_json")
+
+# pylint: disable=wrong-import-position
+from configuration.data import PatchLayer, PatchSet
+from configuration.decode import layer_header_from_dict, patch_layer_from_json, patch_set_from_json
+
+LAYER_JSON = '''{
+    "id": "child",
+    "parents": ["a", "b"],
+    "tree_ids": ["child_a", "child_b"],
+    "title": "A child",
+    "unknown": "is ignored",
+    "patches": [
+        {"basePath": "sub", "patch": "sub/0001.patch", "tags": "x, y"},
+        {"basePath": "", "patch": "", "script": "run.sh", "scriptArgs": ["-v"],
+         "scriptResources": ["res/**/*"], "comment": "runs it"},
+        {"basePath": "", "patch": "", "copyPattern": "**/*", "copySourceDir": "f",
+         "updateModulesAfterPatch": true},
+        {"basePath": "", "patch": "", "baseline": "child"}
+    ]
+}'''
+
+
+def test_layer_matches_dataclasses_json():
+    """The fast path creates the same layer as dataclasses_json"""
+    # pylint: disable=no-member
+    assert patch_layer_from_json(LAYER_JSON) == PatchLayer.from_json(LAYER_JSON)
+    assert patch_layer_from_json("{}") == PatchLayer.from_json("{}")
+
+
+def test_patch_set_matches_dataclasses_json():
+    """The fast path creates the same patch set as dataclasses_json"""
+    patch_set = PatchSet(patches=patch_layer_from_json(LAYER_JSON).patches)
+    # pylint: disable=no-member
+    content = patch_set.to_json(indent=2)
+    assert patch_set_from_json(content) == PatchSet.from_json(content)
+    assert patch_set_from_json(content) == patch_set
+
+
+def test_invalid_content():
+    """Invalid json and missing required keys fail like with dataclasses_json"""
+    with pytest.raises(ValueError):
+        patch_layer_from_json('{"id": ')
+    with pytest.raises(KeyError):
+        patch_layer_from_json('{"patches": [{"basePath": ""}]}')
+    with pytest.raises(KeyError):
+        patch_set_from_json('{"patches": [{"patch": ""}]}')
+
+
+def test_layer_header():
+    """The header keeps the tree entries of a layer and checks their types"""
+    assert layer_header_from_dict(json.loads(LAYER_JSON)) == {
+        "id": "child", "parents": ["a", "b"], "tree_ids": ["child_a", "child_b"], "title": "A child"}
+    assert layer_header_from_dict({}) == {}
+    with pytest.raises(ValueError):
+        layer_header_from_dict([])
+    with pytest.raises(ValueError):
+        layer_header_from_dict({"id": 1})
+    with pytest.raises(ValueError):
+        layer_header_from_dict({"parents": "a"})
+    with pytest.raises(ValueError):
+        layer_header_from_dict({"parents": ["a", None]})
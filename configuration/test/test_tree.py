@@ -0,0 +1,49 @@
+"""Unit tests for the layer tree construction"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import pytest
+
+pytest.importorskip("treelib")
+pytest.importorskip("dataclasses_json")
+
+# pylint: disable=wrong-import-position
+from configuration.data import PatchConfig, PatchLayer
+from configuration.tree import build_layer_tree
+
+
+def test_build_layer_tree_empty():
+    """Without a base layer we get an empty tree"""
+    tree = build_layer_tree(None, [PatchLayer(id="a", parent="root")])
+    assert tree.root is None
+
+
+def test_build_layer_tree():
+    """Single and multi parent layers end up at the expected positions"""
+    root = PatchLayer(id="root")
+    layers = [
+        PatchLayer(id="c", parent="b"),
+        PatchLayer(id="a", parent="root"),
+        PatchLayer(id="b", parent="root"),
+        PatchLayer(id="mixin", parents=["a", "b"],
+                   patches=[PatchConfig(basePath="", patch="0001.patch")]),
+        PatchLayer(id="named", parents=["a", "c"], tree_ids=["named_a", "named_c"]),
+        PatchLayer(id="orphan", parent="missing"),
+    ]
+    tree = build_layer_tree(root, layers)
+
+    assert tree.root == "root"
+    assert [node.identifier for node in tree.children("root")] == ["a", "b"]
+    assert tree.parent("c").identifier == "b"
+    assert tree.parent("mixin_1").identifier == "a"
+    assert tree.parent("mixin_2").identifier == "b"
+    assert tree.parent("named_a").identifier == "a"
+    assert tree.parent("named_c").identifier == "c"
+    assert tree.get_node("orphan") is None
+    assert tree.get_node("mixin_2").data.patches[0].patch == "0001.patch"
+    assert tree.get_node("mixin_2").data.patches is tree.get_node("mixin_1").data.patches
+    assert tree.get_node("mixin_2").data.title == tree.get_node("mixin_1").data.title
+    assert len(tree) == 8
@@ -0,0 +1,53 @@
+'''Builds the layer tree from a set of parsed layer configurations'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import collections
+
+import treelib
+
+from configuration.data import LayerView
+
+
+def build_child_index(layers):
+    '''Returns a dict mapping each referenced parent id to a list of
+    (layer, parent position) tuples. The position is None for layers
+    using parent and the index into parents for multi-parent layers.
+    Children keep the order in which the layers were passed in.'''
+    children = collections.defaultdict(list)
+    for layer in layers:
+        if layer.parent:
+            children[layer.parent].append((layer, None))
+        for pos, parent_id in enumerate(layer.parents):
+            if parent_id == layer.parent:
+                # parent takes precedence over the same entry in parents
+                continue
+            children[parent_id].append((layer, pos))
+    return children
+
+
+def build_layer_tree(base_layer, layers):
+    '''Creates the layer tree starting at base_layer using a single
+    breadth-first walk over a parent -> children index. Layers that
+    list multiple parents are added once per parent as a LayerView
+    using the id returned by get_id_from_index.'''
+    layer_tree = treelib.Tree()
+    if base_layer is None:
+        return layer_tree
+    children = build_child_index(layers)
+    layer_tree.create_node(base_layer.id, base_layer.id, data=base_layer)
+    queue = collections.deque([base_layer.id])
+    while queue:
+        parent_id = queue.popleft()
+        for layer, pos in children.get(parent_id, ()):
+            if pos is None:
+                node_layer = layer
+            else:
+                node_layer = LayerView(layer, layer.get_id_from_index(pos))
+            layer_tree.create_node(node_layer.id, node_layer.id,
+                                   parent=parent_id, data=node_layer)
+            queue.append(node_layer.id)
+    return layer_tree
@@ -0,0 +1,152 @@
+'''Content-addressed file store used to deduplicate the files of several patchsets.
+
+Every distinct file content is copied into the store once, named by its
+SHA-256 and its permission bits, so files with equal content but different
+modes (e.g. a script and a resource) do not share an inode. Targets are
+hard links to the stored file, so identical patches, scripts and files of
+many patchsets share their data on disk. Where hard links are not possible
+(e.g. on some network or FAT file systems) targets are copied instead.
+
+place_file puts a single file at a target using one of LINK_MODES and falls
+back to the next cheaper mechanism the file system supports: hard link,
+reflink (FICLONE, a copy-on-write clone sharing the data blocks), in-kernel
+copy (copy_file_range) and finally a plain copy.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+LINK_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+
+def file_sha256(filename):
+    '''Returns the sha256 hex digest of a file, reading it in chunks'''
+    digest = hashlib.sha256()
+    with open(filename, "rb") as content:
+        for chunk in iter(lambda: content.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_content(source, target, clone):
+    '''Copies the content of source to the new file target, trying a reflink first
+    if clone is set, then copy_file_range, then a copy in user space. Returns the
+    mode used.'''
+    with open(source, "rb") as source_content, open(target, "wb") as target_content:
+        if clone and fcntl is not None:
+            try:
+                fcntl.ioctl(target_content.fileno(), FICLONE, source_content.fileno())
+                return "reflink"
+            except OSError as error:
+                logger.debug("Cannot reflink %s, copying it: %s", target, error)
+        if hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(source_content.fileno()).st_size
+                while remaining > 0:
+                    count = os.copy_file_range(source_content.fileno(), target_content.fileno(), remaining)
+                    if count == 0:
+                        break
+                    remaining -= count
+                return "copy"
+            except OSError as error:
+                logger.debug("Cannot copy %s in the kernel: %s", target, error)
+                source_content.seek(0)
+                target_content.seek(0)
+                target_content.truncate()
+        shutil.copyfileobj(source_content, target_content)
+    return "copy"
+
+
+def place_file(source, target, link_mode="copy"):
+    '''Places the content of source at target like shutil.copy(source, target),
+    replacing an existing target. link_mode is one of LINK_MODES; if it is not
+    supported, the next cheaper mechanism is used. Returns the mode used.'''
+    if os.path.lexists(target):
+        os.remove(target)
+    if link_mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(source), target)
+            return "symlink"
+        except OSError as error:
+            logger.debug("Cannot symlink %s, copying it: %s", target, error)
+    if link_mode == "hardlink":
+        try:
+            os.link(source, target)
+            return "hardlink"
+        except OSError as error:
+            logger.debug("Cannot hard link %s, cloning it: %s", target, error)
+    used = _copy_content(source, target, link_mode in ("hardlink", "reflink"))
+    shutil.copymode(source, target)
+    return used
+
+
+class FileStore():
+    '''Content-addressed store in store_dir. The digest of each source file is only
+    computed once, sources are expected not to change while the store is used.
+    Files may be added and linked from several threads. Targets are placed with
+    link_mode, see place_file.'''
+
+    def __init__(self, store_dir, link_mode="hardlink"):
+        self.store_dir = store_dir
+        self.link_mode = link_mode
+        self.digests = {}
+        self.stored = 0
+        self.linked = 0
+        self.copied = 0
+        self.lock = threading.Lock()
+
+    def add(self, source):
+        '''Puts a copy of source into the store (if its content is new) and
+        returns the path of the stored file'''
+        source = os.path.abspath(source)
+        key = self.digests.get(source)
+        if key is None:
+            # a hard link shares the mode of the stored file, so the mode is part of the key
+            key = file_sha256(source) + "_" + format(os.stat(source).st_mode & 0o777, "o")
+            with self.lock:
+                self.digests[source] = key
+        stored_file = os.path.join(self.store_dir, key[:2], key)
+        if not os.path.exists(stored_file):
+            os.makedirs(os.path.dirname(stored_file), exist_ok=True)
+            # threads storing the same content at once each write their own temp file
+            temp_file = stored_file + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+            place_file(source, temp_file, "reflink")
+            os.replace(temp_file, stored_file)
+            with self.lock:
+                self.stored += 1
+        return stored_file
+
+    def link(self, source, target):
+        '''Places the content of source at target, like shutil.copy(source, target)'''
+        stored_file = self.add(source)
+        linked = place_file(stored_file, target, self.link_mode) == self.link_mode
+        with self.lock:
+            if linked:
+                self.linked += 1
+            else:
+                self.copied += 1
+
+    def remove(self):
+        '''Deletes the store. Linked targets keep their content.'''
+        logger.info("Stored %d unique files for %d links and %d copies",
+                    self.stored, self.linked, self.copied)
+        shutil.rmtree(self.store_dir, ignore_errors=True)
@@ -36,6 +36,12 @@ def layer_config_exists(ctx):
     '''Check if we parsed a layer config'''
     return 'LAYER_SOURCE' in ctx.obj and 'LAYER_TREE' in ctx.obj and ctx.obj['LAYER_TREE'].root is not None
 
+def get_jobs(ctx):
+    '''Returns the number of parallel workers selected using --jobs'''
+    if ctx is None or not ctx.obj:
+        return 1
+    return ctx.obj.get('JOBS', 1)
+
 def remove_empty_folders(path, remove_base=True):
     'Function to recursively remove empty folders'
 
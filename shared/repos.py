@@ -0,0 +1,60 @@
+'''Registry of cached git repository handles.
+
+Creating a Repo is cheap, but GitPython starts its persistent
+"git cat-file --batch" and "--batch-check" processes per Repo instance to
+read objects (commits, trees, messages). Looking up the Repo of a path
+here instead of creating a new one keeps these processes running for all
+later operations on the same repository.
+
+A Repo and its cat-file processes must not be used by several threads at
+once, so each thread gets its own cache. The repositories of a thread are
+released when it ends or when clear_repos is called; apply_patchset and
+the CLI commands call it when they are done, so a repository replaced on
+disk is opened again by the next call.'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import logging
+import os
+import threading
+
+from git import Repo
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _get_cache():
+    cache = getattr(_local, "repos", None)
+    if cache is None:
+        cache = _local.repos = {}
+    return cache
+
+
+def get_repo_key(path):
+    '''Returns the normalized path identifying the repository at path'''
+    return os.path.normcase(os.path.abspath(path))
+
+
+def get_repo(path):
+    '''Returns the Repo of the repository at path for the calling thread,
+    creating it on first use'''
+    key = get_repo_key(path)
+    cache = _get_cache()
+    repo = cache.get(key)
+    if repo is None:
+        repo = cache[key] = Repo(key)
+    return repo
+
+
+def clear_repos():
+    '''Closes the repositories cached for the calling thread, stopping their
+    git processes'''
+    cache = _get_cache()
+    for repo in cache.values():
+        repo.close()
+    cache.clear()
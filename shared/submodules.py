@@ -0,0 +1,80 @@
+'''Walks a git repository and all its (nested) submodules, optionally in parallel'''
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import concurrent.futures
+import logging
+
+from shared.repos import get_repo
+
+logger = logging.getLogger(__name__)
+
+
+def get_repository_tree(path):
+    '''Returns a list of (working tree dir, depth) tuples for the repository
+    at path (depth 0) and all its nested submodules in pre-order, e.g. each
+    repository is followed by its submodules in the order git lists them.'''
+    repositories = []
+    pending = [(get_repo(path).working_tree_dir, 0)]
+    while pending:
+        repo_path, depth = pending.pop()
+        repositories.append((repo_path, depth))
+        modules = [
+            (get_repo(module.abspath).working_tree_dir, depth + 1)
+            for module in get_repo(repo_path).submodules]
+        pending.extend(reversed(modules))
+    return repositories
+
+
+def get_post_order(repositories):
+    '''Reorders a pre-order repository tree so that each repository
+    follows its submodules'''
+    result = []
+    stack = []
+    for repo_path, depth in repositories:
+        while stack and stack[-1][1] >= depth:
+            result.append(stack.pop())
+        stack.append((repo_path, depth))
+    result.extend(reversed(stack))
+    return result
+
+
+def walk_repositories(repositories, function, jobs=1, children_first=False):
+    '''Calls function(path) for every repository of a tree created by
+    get_repository_tree, using up to jobs threads. Returns a list of
+    (path, result) tuples in the order of a serial recursion: pre-order,
+    or post-order if children_first is set. With children_first a
+    repository is only handled once all of its submodules are done, e.g.
+    for committing updated submodules.
+
+    If calls fail (this includes exit_with_error), the exception of the
+    first failing repository in that order is raised once all running
+    calls have finished.'''
+    ordered = get_post_order(repositories) if children_first else list(repositories)
+    if jobs <= 1 or len(ordered) < 2:
+        return [(repo_path, function(repo_path)) for repo_path, _ in ordered]
+
+    # Without dependencies all repos form one batch. Otherwise we run one
+    # batch per depth, starting with the deepest submodules.
+    if children_first:
+        depths = sorted({depth for _, depth in ordered}, reverse=True)
+        batches = [[repo_path for repo_path, depth in ordered if depth == batch_depth]
+                   for batch_depth in depths]
+    else:
+        batches = [[repo_path for repo_path, _ in ordered]]
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for batch in batches:
+            futures = {repo_path: executor.submit(function, repo_path) for repo_path in batch}
+            concurrent.futures.wait(futures.values())
+            for repo_path in [repo_path for repo_path, _ in ordered if repo_path in futures]:
+                error = futures[repo_path].exception()
+                if error is not None:
+                    logger.error("Failed handling repository %s", repo_path)
+                    raise error
+                results[repo_path] = futures[repo_path].result()
+    return [(repo_path, results[repo_path]) for repo_path, _ in ordered]
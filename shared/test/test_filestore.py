@@ -0,0 +1,67 @@
+"""Unit tests for the content-addressed file store"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import os
+
+import pytest
+
+from shared.filestore import LINK_MODES, FileStore, place_file
+
+
+def test_file_store(tmp_path):
+    """Equal contents are stored once and linked to all targets"""
+    (tmp_path / "a.patch").write_text("same")
+    (tmp_path / "b.patch").write_text("same")
+    (tmp_path / "c.patch").write_text("other")
+    store = FileStore(str(tmp_path / "store"))
+    for name in ("a.patch", "b.patch", "c.patch"):
+        store.link(str(tmp_path / name), str(tmp_path / ("linked_" + name)))
+    store.link(str(tmp_path / "a.patch"), str(tmp_path / "linked_a.patch"))
+
+    assert store.stored == 2
+    assert os.path.samefile(tmp_path / "linked_a.patch", tmp_path / "linked_b.patch")
+    assert not os.path.samefile(tmp_path / "linked_a.patch", tmp_path / "linked_c.patch")
+
+    store.remove()
+    assert not os.path.exists(tmp_path / "store")
+    assert (tmp_path / "linked_b.patch").read_text() == "same"
+    assert (tmp_path / "linked_c.patch").read_text() == "other"
+
+
+def test_file_store_keeps_modes(tmp_path):
+    """Equal contents with different modes are stored separately and keep their mode"""
+    (tmp_path / "script.sh").write_text("same")
+    os.chmod(tmp_path / "script.sh", 0o755)
+    (tmp_path / "resource").write_text("same")
+    os.chmod(tmp_path / "resource", 0o644)
+    store = FileStore(str(tmp_path / "store"))
+    store.link(str(tmp_path / "resource"), str(tmp_path / "linked_resource"))
+    store.link(str(tmp_path / "script.sh"), str(tmp_path / "linked_script.sh"))
+
+    assert store.stored == 2
+    assert not os.path.samefile(tmp_path / "linked_resource", tmp_path / "linked_script.sh")
+    assert os.stat(tmp_path / "linked_resource").st_mode & 0o777 == 0o644
+    assert os.stat(tmp_path / "linked_script.sh").st_mode & 0o777 == 0o755
+    store.remove()
+
+
+@pytest.mark.parametrize("link_mode", LINK_MODES)
+def test_place_file(tmp_path, link_mode):
+    """Every link mode places the content and mode bits of the source, replacing the target"""
+    source = tmp_path / "script.sh"
+    source.write_text("echo patched")
+    os.chmod(source, 0o755)
+    target = tmp_path / "placed.sh"
+    target.write_text("old")
+
+    used = place_file(str(source), str(target), link_mode)
+
+    assert used in (link_mode, "reflink", "copy")
+    assert target.read_text() == "echo patched"
+    assert os.stat(target).st_mode & 0o777 == 0o755
+    assert os.path.islink(target) == (used == "symlink")
+    assert os.path.samefile(source, target) == (used in ("hardlink", "symlink"))
@@ -0,0 +1,35 @@
+"""Unit tests for the repository registry"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import os
+import threading
+
+import pytest
+
+git = pytest.importorskip("git")
+
+# pylint: disable=wrong-import-position
+from shared.repos import clear_repos, get_repo
+
+
+def test_get_repo_cached_per_thread(tmp_path):
+    """A thread gets the same Repo for a path, other threads get their own"""
+    git.Repo.init(tmp_path)
+    repo = get_repo(str(tmp_path))
+    assert get_repo(str(tmp_path) + os.sep) is repo
+    assert get_repo(os.path.join(str(tmp_path), ".")) is repo
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_repo(str(tmp_path))))
+    thread.start()
+    thread.join()
+    assert other[0] is not repo
+    assert other[0].working_tree_dir == repo.working_tree_dir
+
+    clear_repos()
+    assert get_repo(str(tmp_path)) is not repo
+    clear_repos()
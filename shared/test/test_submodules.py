@@ -0,0 +1,67 @@
+"""Unit tests for the submodule walker"""
+
+__copyright__ = "Copyright (c) 2023, Avnet EMG GmbH"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__status__ = "Development"
+
+import threading
+
+import pytest
+
+pytest.importorskip("git")
+
+# pylint: disable=wrong-import-position
+from shared.submodules import get_post_order, walk_repositories
+
+# root
+# ├── a
+# │   ├── a1
+# │   └── a2
+# └── b
+#     └── b1
+REPOSITORIES = [("root", 0), ("a", 1), ("a1", 2), ("a2", 2), ("b", 1), ("b1", 2)]
+POST_ORDER = ["a1", "a2", "a", "b1", "b", "root"]
+CHILDREN = {"root": ["a", "b"], "a": ["a1", "a2"], "b": ["b1"]}
+
+
+def test_get_post_order():
+    """Each repository follows its submodules"""
+    assert [path for path, _ in get_post_order(REPOSITORIES)] == POST_ORDER
+    assert get_post_order([("root", 0)]) == [("root", 0)]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_walk_repositories_order(jobs):
+    """Results are returned in the order of a serial recursion"""
+    result = walk_repositories(REPOSITORIES, str.upper, jobs)
+    assert result == [(path, path.upper()) for path, _ in REPOSITORIES]
+    result = walk_repositories(REPOSITORIES, str.upper, jobs, children_first=True)
+    assert result == [(path, path.upper()) for path in POST_ORDER]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_walk_repositories_children_first(jobs):
+    """With children_first, submodules are done before their parents"""
+    done = set()
+    lock = threading.Lock()
+
+    def handle(path):
+        with lock:
+            assert all(child in done for child in CHILDREN.get(path, []))
+            done.add(path)
+
+    walk_repositories(REPOSITORIES, handle, jobs, children_first=True)
+    assert len(done) == len(REPOSITORIES)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_walk_repositories_error(jobs):
+    """The error of the first failing repository is raised"""
+    def handle(path):
+        if path in ("a2", "b1"):
+            raise SystemExit(path)
+        return path
+
+    with pytest.raises(SystemExit, match="a2"):
+        walk_repositories(REPOSITORIES, handle, jobs)
@@ -7,18 +7,23 @@ __license__ = "MIT"
 __version__ = "0.1.0"
 __status__ = "Development"
 
+import concurrent.futures
+import functools
 import glob
+import itertools
 import logging
 import os
-import copy
 
 import click
 import coloredlogs
-import treelib
 
 from commands import baseline, info, patchset
-from configuration.data import PatchLayer
+from configuration.cache import LayerCache, default_cache_file, default_header_cache_file
+from configuration.data import LazyLayer
+from configuration.decode import layer_header_from_dict, patch_layer_from_json
+from configuration.tree import build_layer_tree
 from shared.helpers import exit_with_error
+from shared.repos import clear_repos
 
 # Logging setup...
 logger = logging.getLogger(__name__)
@@ -39,8 +44,25 @@ logger = logging.getLogger(__name__)
                       case_sensitive=False),
     show_default=True,
     help='Set log level.')
+@click.option(
+    '--no_cache', is_flag=True, required=False,
+    type=click.BOOL, default=False,
+    help='''If set, the layer cache (a hidden file next to the layers dir)
+    is neither read nor written and all layer files are parsed.''')
+@click.option(
+    '--lazy', is_flag=True, required=False,
+    type=click.BOOL, default=False,
+    help='''If set, a separate cache only keeps the entries of each layer needed to
+    build the layer tree, so unchanged layers are not decoded. Their patches are
+    decoded once a command uses them, e.g. only for the layers of one branch.
+    Without the cache (--no_cache) all layers are decoded.''')
+@click.option(
+    '--jobs', '-j', required=False,
+    type=click.IntRange(min=1), default=1,
+    show_default=True,
+    help='Number of parallel workers, e.g. used to parse layer files.')
 @click.pass_context
-def cli(ctx, log_level, layersdir):
+def cli(ctx, log_level, layersdir, no_cache, lazy, jobs):
     """This is run before all other commands;
     used to provide context content."""
     # activate logging first...
@@ -48,8 +70,18 @@ def cli(ctx, log_level, layersdir):
     logger.info("Reading layer configuration from %s", layersdir)
     # now prepare config & pass it via context
     ctx.ensure_object(dict)
+    # stop the git processes of the cached repositories once the command is done
+    ctx.call_on_close(clear_repos)
+    ctx.obj['JOBS'] = jobs
     if layersdir:
         ctx.obj['LAYER_SOURCE'] = layersdir
+        if no_cache:
+            ctx.obj['LAYER_CACHE'] = None
+        elif lazy:
+            ctx.obj['LAYER_CACHE'] = default_header_cache_file(layersdir)
+        else:
+            ctx.obj['LAYER_CACHE'] = default_cache_file(layersdir)
+        ctx.obj['LAZY'] = lazy
         ctx.obj['LAYER_TREE'] = parse_tree_from_layers(ctx)
 
         leaves = ctx.obj['LAYER_TREE'].leaves()
@@ -77,9 +109,41 @@ def parse_tree_from_layers(ctx):
 
     os.chdir(previous_dir)
 
+    cache = None
+    if ctx.obj.get('LAYER_CACHE'):
+        cache = LayerCache(ctx.obj['LAYER_CACHE'])
+        cache.load()
+
+    # first take what we can from the cache...
+    lazy = ctx.obj.get('LAZY')
+    layer_configs = {}
+    for layer_file in layer_files:
+        layer_config = None
+        if cache is not None:
+            layer_config = cache.get(layers_dir, layer_file)
+        if layer_config is not None and lazy:
+            # the lazy cache only holds the header, the patches are decoded on first use
+            layer_config = LazyLayer(
+                layer_config, functools.partial(load_layer_config, layers_dir, layer_file))
+        if layer_config is not None:
+            layer_configs[layer_file] = layer_config
+
+    # ...then parse the remaining files, possibly in parallel
+    files_to_parse = [layer_file for layer_file in layer_files if layer_file not in layer_configs]
+    parsed_layers = dict(zip(
+        files_to_parse,
+        read_layer_configs(layers_dir, files_to_parse, ctx.obj.get('JOBS', 1))))
+
     for layer_file in layer_files:
-        logger.info("Loading layer configuration from: %s", layer_file)
-        layer_config = load_layer_config(layers_dir, layer_file)
+        if layer_file in parsed_layers:
+            logger.info("Loading layer configuration from: %s", layer_file)
+            layer_config, error = parsed_layers[layer_file]
+            if error:
+                exit_with_error(error)
+            if cache is not None:
+                cache.put(layer_file, get_layer_header(layer_file, layer_config) if lazy else layer_config)
+        else:
+            layer_config = layer_configs[layer_file]
         layer_id = layer_config.id
         if not layer_config.have_parent():
             if base_layer is not None:
@@ -93,48 +157,60 @@ def parse_tree_from_layers(ctx):
                     "Found duplicate in layer configuration: " + layer_file)
             layers[layer_id] = layer_config
 
-    layer_tree = treelib.Tree()
-    if base_layer is None:
-        return layer_tree
-    layer_tree.create_node(base_layer.id, base_layer.id, data=base_layer)
-    new_leaves = True
-    while new_leaves:
-        new_leaves = False
-        leaves = layer_tree.leaves()
-        # now we iterate though all leaves and check if we find a layer that
-        # makes one of them as a parent.
-        for leaf in leaves:
-            for layer in layers.values():
-                if layer.parent == leaf.data.id:
-                    layer_tree.create_node(layer.id, layer.id,
-                                           parent=leaf.data.id, data=layer)
-                    new_leaves = True
-                elif leaf.data.id in layer.parents:
-                    # found an entry in parents...
-                    pos = layer.parents.index(leaf.data.id)
-                    new_layer = copy.deepcopy(layer)
-                    new_layer.id = layer.get_id_from_index(pos)
-                    layer_tree.create_node(new_layer.id, new_layer.id, parent=leaf.data.id, data=new_layer)
-                    new_leaves = True
-    return layer_tree
+    if cache is not None:
+        logger.info("Took %d of %d layers from cache %s",
+                    cache.hits, len(layer_files), cache.cache_file)
+        cache.save(layer_files)
 
+    return build_layer_tree(base_layer, layers.values())
 
-def load_layer_config(config_folder, layer_filename):
-    """Loads layer config for a given type"""
+
+def read_layer_configs(config_folder, layer_filenames, jobs=1):
+    """Reads the given layer files using up to jobs processes. Returns a list of
+    (layer, error) tuples in the order of layer_filenames, see read_layer_config."""
+    if jobs <= 1 or len(layer_filenames) < 2:
+        return [read_layer_config(config_folder, layer_filename)
+                for layer_filename in layer_filenames]
+    chunksize = max(1, len(layer_filenames) // (jobs * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(
+            read_layer_config,
+            itertools.repeat(config_folder),
+            layer_filenames,
+            chunksize=chunksize))
+
+
+def read_layer_config(config_folder, layer_filename):
+    """Reads and decodes a layer file. Returns a tuple of the layer and
+    an error message; exactly one of them is None."""
     layer_file = os.path.abspath(os.path.join(config_folder, layer_filename))
     if not os.path.isfile(layer_file):
-        exit_with_error("Could not find " + layer_file)
+        return None, "Could not find " + layer_file
 
     with open(layer_file, encoding='UTF-8') as json_content:
         # Further file processing goes here
         data_json = json_content.read()
         try:
-            # pylint: disable=no-member
-            data_layer = PatchLayer.from_json(data_json)
-            return data_layer
+            return patch_layer_from_json(data_json), None
         except ValueError as value_error:
-            exit_with_error(value_error)
-    return PatchLayer(id='', parent='', description='', title='')
+            return None, str(value_error)
+
+
+def load_layer_config(config_folder, layer_filename):
+    """Loads layer config for a given type"""
+    layer_config, error = read_layer_config(config_folder, layer_filename)
+    if error:
+        exit_with_error(error)
+    return layer_config
+
+
+def get_layer_header(layer_filename, layer_config):
+    """Returns the checked entries of a layer needed to place it in the layer tree"""
+    try:
+        return layer_header_from_dict(
+            {name: getattr(layer_config, name) for name in LazyLayer.HEADER_FIELDS})
+    except ValueError as value_error:
+        exit_with_error(layer_filename + ": " + str(value_error))
 
 
 cli.add_command(info.info)